@@ -1,6 +1,15 @@
 import argparse
+from bisect import bisect_left, bisect_right
+from concurrent.futures import ThreadPoolExecutor
+import csv
+import json
+import os
 from pathlib import Path
+import re
 import subprocess
+import tempfile
+import threading
+import time
 from datetime import timedelta
 
 INPUT_SAMMA_ARGS = ['-c:v', 'libopenjpeg']
@@ -8,6 +17,30 @@ DEFAULT_VIDEO_ARGS = [
     '-r', '25', '-c:v', 'libx264', '-pix_fmt', 'yuv420p',
     '-crf', '23', '-movflags', '+faststart', '-c:a', 'aac']
 DEFAULT_AUDIO_ARGS = ['-c:a', 'libmp3lame', '-qscale:a', '2']
+# Re-encoded pieces of a smart cut must match the copied ones, so keep the
+# source frame rate rather than forcing -r
+SMART_VIDEO_ARGS = [
+    '-c:v', 'libx264', '-pix_fmt', 'yuv420p', '-crf', '23', '-c:a', 'aac']
+SMART_CODECS = ('h264',)
+# Sources already in these forms can go out as access copies untouched
+COPY_VIDEO_CODECS = ('h264',)
+COPY_AUDIO_CODECS = ('aac',)
+COPY_PIX_FMTS = ('yuv420p',)
+COPY_MAX_HEIGHT = 1080
+PROBE_CACHE = Path.home() / '.av_redacter_probes.json'
+DERIVATIVES = ('mp4', 'mp3', 'poster')
+POSTER_ARGS = ['-q:v', '2']
+POSTER_INTERVAL = 60
+# Keyframes this close to a cut point (about a frame) count as on it
+KEYFRAME_SLOP = 0.04
+# Stream copies seek just past their keyframe, as ffmpeg starts a copy from
+# the keyframe at or before the seek point
+SEEK_EPSILON = 0.001
+QUIET_ARGS = ['-loglevel', 'error']
+PROGRESS_ARGS = ['-nostdin', '-progress', 'pipe:1', '-nostats']
+REPORT_FIELDS = [
+    'file', 'output', 'status', 'attempts', 'error', 'wall_time', 'out_time',
+    'realtime', 'input_bytes', 'output_bytes']
 
 
 def conv_to_seconds(tstring):
@@ -36,7 +69,7 @@ def get_segments(redactions):
     return segments
 
 
-def get_filter_args(segments, video=True):
+def get_filter_args(segments, video=True, audio=True):
     'Constructs a string for -filter_complex'
     args = ''
     seg_num = 0
@@ -45,24 +78,96 @@ def get_filter_args(segments, video=True):
         if end is not None:
             if video:
                 args += f'[0:v]trim=start={start}:end={end},setpts=PTS-STARTPTS,format=yuv420p[{seg_num}v];'
-            args += f'[0:a]atrim=start={start}:end={end},asetpts=PTS-STARTPTS[{seg_num}a];'
+            if audio:
+                args += f'[0:a]atrim=start={start}:end={end},asetpts=PTS-STARTPTS[{seg_num}a];'
         else:
             if video:
                 args += f'[0:v]trim=start={start},setpts=PTS-STARTPTS,format=yuv420p[{seg_num}v];'
-            args += f'[0:a]atrim=start={start},asetpts=PTS-STARTPTS[{seg_num}a];'
+            if audio:
+                args += f'[0:a]atrim=start={start},asetpts=PTS-STARTPTS[{seg_num}a];'
     for x in range(1, seg_num+1):
         if video:
-            args += f'[{x}v][{x}a]'
-        else:
+            args += f'[{x}v]'
+        if audio:
             args += f'[{x}a]'
+    args += f'concat=n={seg_num}:v={int(video)}:a={int(audio)}'
     if video:
-        args += f'concat=n={seg_num}:v=1:a=1[outv][outa]'
-    else:
-        args += f'concat=n={seg_num}:v=0:a=1[outa]'
+        args += '[outv]'
+    if audio:
+        args += '[outa]'
     return args
 
 
-def make_access_file(file, redactions=None, input_args=None, output_args=None, outfile=None, video=True):
+def out_seconds(progress):
+    'Returns the output time reached in an ffmpeg progress block in seconds.'
+    for key in ('out_time_us', 'out_time_ms'):
+        # out_time_ms is also in microseconds, despite the name
+        value = progress.get(key, 'N/A')
+        if value.lstrip('-').isdigit():
+            return max(int(value), 0) / 1000000
+    return 0.0
+
+
+def run_ffmpeg(args, quiet=False):
+    'Runs an ffmpeg command with its -progress output piped back, showing '
+    'frame, fps, speed and out_time as it goes unless quiet. Returns the '
+    'last progress block as a dict, or raises CalledProcessError.'
+    args[1:1] = PROGRESS_ARGS
+    if quiet:
+        args[1:1] = QUIET_ARGS
+    else:
+        print(args)
+    progress = {}
+    block = {}
+    with subprocess.Popen(
+            args, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE,
+            text=True) as proc:
+        for line in proc.stdout:
+            key, _, value = line.strip().partition('=')
+            block[key] = value.strip()
+            if key != 'progress':
+                continue
+            progress = block
+            block = {}
+            if not quiet:
+                print(
+                    f"\rframe={progress.get('frame', '-')} "
+                    f"fps={progress.get('fps', '-')} "
+                    f"speed={progress.get('speed', '-')} "
+                    f"out_time={progress.get('out_time', '-')}",
+                    end='', flush=True)
+    if not quiet and progress:
+        print()
+    if proc.returncode:
+        raise subprocess.CalledProcessError(proc.returncode, args)
+    return progress
+
+
+def job_summary(file, outfile, progress, wall_time):
+    'Returns the summary record for one finished job. outfile may be a list '
+    'of paths when the job wrote several.'
+    out_time = out_seconds(progress)
+    if isinstance(outfile, (str, Path)):
+        outfile = [outfile]
+    return {
+        'wall_time': round(wall_time, 2),
+        'out_time': round(out_time, 2),
+        'realtime': round(out_time / wall_time, 2) if wall_time else 0.0,
+        'input_bytes': Path(file).stat().st_size,
+        'output_bytes': sum(Path(f).stat().st_size for f in outfile)}
+
+
+def print_summary(file, summary):
+    print(
+        f"{Path(file).name}: {summary['out_time']}s of output in "
+        f"{summary['wall_time']}s ({summary['realtime']}x realtime), "
+        f"{summary['input_bytes']} bytes in, "
+        f"{summary['output_bytes']} bytes out")
+
+
+def make_access_file(file, redactions=None, input_args=None, output_args=None, outfile=None, video=True, quiet=False, audio=True):
+    'Makes the access file in one transcode. Returns the output path and '
+    'the final ffmpeg progress block.'
     file = Path(file)
     if video:
         ext = '.mp4'
@@ -77,13 +182,12 @@ def make_access_file(file, redactions=None, input_args=None, output_args=None, o
     args = ['ffmpeg', '-i', str(file), str(outfile)]
     if redactions is not None:
         segments = get_segments(redactions)
-        filter = get_filter_args(segments, video=video)
+        filter = get_filter_args(segments, video=video, audio=audio)
+        filter_args = ['-filter_complex', filter]
         if video:
-            filter_args = [
-                '-filter_complex', filter, '-map', '[outv]', '-map', '[outa]']
-        else:
-            filter_args = [
-                '-filter_complex', filter, '-map', '[outa]']
+            filter_args += ['-map', '[outv]']
+        if audio:
+            filter_args += ['-map', '[outa]']
         i = args.index(str(outfile))
         args[i:i] = filter_args
     if input_args is not None:
@@ -92,37 +196,439 @@ def make_access_file(file, redactions=None, input_args=None, output_args=None, o
     if output_args is not None:
         i = args.index(str(outfile))
         args[i:i] = output_args
-    print(args)
-    subprocess.run(args, stdout=subprocess.PIPE)
+    return outfile, run_ffmpeg(args, quiet=quiet)
 
 
-def main(file, redactions=None, crf=None, output_args=None, outfile=None):
+def make_derivatives(file, info, derivatives=DERIVATIVES, redactions=None, video_args=None, audio_args=None, outfile=None, quiet=False, poster_interval=POSTER_INTERVAL):
+    'Makes several access derivatives in one ffmpeg run, so file is decoded '
+    'and redacted once and split/asplit feed each output. Returns the paths '
+    'written and the final ffmpeg progress block.'
     file = Path(file)
-    if file.suffix in ('.mp3', '.wav'):
-        video = False
-        args = DEFAULT_AUDIO_ARGS
+    if outfile is None:
+        base = Path(file.parent, file.stem + '.access')
+    else:
+        base = Path(outfile).with_suffix('')
+    video = info['video'] is not None
+    audio = info['audio'] is not None
+    wanted = [
+        d for d in derivatives
+        if (d != 'mp4' or video) and (d != 'poster' or video)
+        and (d != 'mp3' or audio)]
+    if not wanted:
+        raise ValueError(f'{file.name} has no streams for {derivatives}')
+    video_outs = [d for d in wanted if d in ('mp4', 'poster')]
+    audio_outs = [d for d in wanted if d in ('mp4', 'mp3')] if audio else []
+    if redactions is not None:
+        filter = get_filter_args(
+            get_segments(redactions), video=bool(video_outs),
+            audio=bool(audio_outs))
     else:
-        video = True
-        args = DEFAULT_VIDEO_ARGS
+        passes = []
+        if video_outs:
+            passes.append('[0:v]null[outv]')
+        if audio_outs:
+            passes.append('[0:a]anull[outa]')
+        filter = ';'.join(passes)
+    if video_outs:
+        filter += f';[outv]split={len(video_outs)}'
+        filter += ''.join(f'[v{d}]' for d in video_outs)
+    if audio_outs:
+        filter += f';[outa]asplit={len(audio_outs)}'
+        filter += ''.join(f'[a{d}]' for d in audio_outs)
+    if 'poster' in video_outs:
+        filter += f';[vposter]fps=1/{poster_interval}[poster]'
+    args = ['ffmpeg']
+    if info['video'] == 'jpeg2000':
+        args += INPUT_SAMMA_ARGS
+    args += ['-i', str(file), '-filter_complex', filter]
+    outfiles = []
+    for derivative in wanted:
+        if derivative == 'mp4':
+            out = Path(base.parent, base.name + '.mp4')
+            args += ['-map', '[vmp4]']
+            if audio:
+                args += ['-map', '[amp4]']
+            args += video_args or DEFAULT_VIDEO_ARGS
+        elif derivative == 'mp3':
+            out = Path(base.parent, base.name + '.mp3')
+            args += ['-map', '[amp3]'] + (audio_args or DEFAULT_AUDIO_ARGS)
+        else:
+            for old in base.parent.glob(base.name + '.poster_*.jpg'):
+                old.unlink()
+            out = Path(base.parent, base.name + '.poster_%03d.jpg')
+            args += ['-map', '[poster]'] + POSTER_ARGS
+        if out.exists():
+            out.unlink()
+        args.append(str(out))
+        outfiles.append(out)
+    progress = run_ffmpeg(args, quiet=quiet)
+    written = []
+    for out in outfiles:
+        if '%' in out.name:
+            written.extend(sorted(
+                out.parent.glob(out.name.replace('%03d', '*'))))
+        else:
+            written.append(out)
+    return written, progress
+
+
+def probe(file, entries, stream='v:0'):
+    'Returns the lines ffprobe prints for entries of a stream in file.'
+    args = [
+        'ffprobe', '-v', 'error', '-select_streams', stream,
+        '-show_entries', entries, '-of', 'csv=p=0', str(file)]
+    result = subprocess.run(
+        args, stdout=subprocess.PIPE, text=True, check=True)
+    return result.stdout.split()
+
+
+def inspect(file):
+    'Returns the codecs, frame size and duration of file from ffprobe. Cover '
+    'art is not counted as a video stream.'
+    args = [
+        'ffprobe', '-v', 'error', '-show_entries',
+        'stream=codec_type,codec_name,width,height,pix_fmt'
+        ':stream_disposition=attached_pic:format=duration',
+        '-of', 'json', str(file)]
+    result = subprocess.run(
+        args, stdout=subprocess.PIPE, text=True, check=True)
+    probed = json.loads(result.stdout)
+    info = {'video': None, 'audio': None, 'width': None, 'height': None,
+            'pix_fmt': None, 'duration': None}
+    for stream in probed.get('streams', []):
+        kind = stream.get('codec_type')
+        if stream.get('disposition', {}).get('attached_pic'):
+            continue
+        if kind == 'video' and info['video'] is None:
+            info['video'] = stream.get('codec_name')
+            info['width'] = stream.get('width')
+            info['height'] = stream.get('height')
+            info['pix_fmt'] = stream.get('pix_fmt')
+        elif kind == 'audio' and info['audio'] is None:
+            info['audio'] = stream.get('codec_name')
+    duration = probed.get('format', {}).get('duration')
+    if duration not in (None, 'N/A'):
+        info['duration'] = float(duration)
+    return info
+
+
+class probe_cache:
+    'Keeps inspect results in a JSON file, keyed by path and reused while '
+    'the file size and mtime are unchanged. Safe to share between threads.'
+    def __init__(self, path=PROBE_CACHE):
+        self.path = Path(path) if path is not None else None
+        self.entries = {}
+        self.changed = False
+        self.lock = threading.Lock()
+        if self.path is not None and self.path.exists():
+            try:
+                with open(self.path, encoding='utf-8') as f:
+                    self.entries = json.load(f)
+            except (OSError, ValueError):
+                self.entries = {}
+
+    def get(self, file):
+        file = Path(file).resolve()
+        stat = file.stat()
+        key = str(file)
+        with self.lock:
+            entry = self.entries.get(key)
+        if (entry is not None and entry['size'] == stat.st_size
+                and entry['mtime'] == stat.st_mtime_ns):
+            return entry['info']
+        info = inspect(file)
+        with self.lock:
+            self.entries[key] = {
+                'size': stat.st_size, 'mtime': stat.st_mtime_ns, 'info': info}
+            self.changed = True
+        return info
+
+    def save(self):
+        if self.path is None or not self.changed:
+            return
+        with self.lock:
+            with open(self.path, 'w', encoding='utf-8') as f:
+                json.dump(self.entries, f)
+            self.changed = False
+
+
+def choose_pipeline(info, redactions=None, smart=False):
+    'Picks the cheapest way to make an access file from inspect results: '
+    'copy, smart, audio or transcode.'
+    if info['video'] is None:
+        return 'audio'
+    suits_access = (
+        info['video'] in COPY_VIDEO_CODECS
+        and info['audio'] in COPY_AUDIO_CODECS + (None,)
+        and info['pix_fmt'] in COPY_PIX_FMTS
+        and (info['height'] or 0) <= COPY_MAX_HEIGHT)
+    if redactions is None:
+        return 'copy' if suits_access else 'transcode'
+    # Copied pieces keep the source streams, so they have to match the 8-bit
+    # 4:2:0 video and AAC audio the encoded pieces get
+    if smart and info['video'] in SMART_CODECS and suits_access:
+        return 'smart'
+    return 'transcode'
+
+
+def get_keyframes(file):
+    'Returns the sorted times in seconds of the video keyframes in file, '
+    'read from the packet flags so nothing is decoded. Times are relative to '
+    'the start of the file, as -ss is.'
+    start_time = probe(file, 'format=start_time')
+    offset = 0.0
+    if start_time and start_time[0] != 'N/A':
+        offset = float(start_time[0])
+    keyframes = []
+    for line in probe(file, 'packet=pts_time,flags'):
+        pts_time, _, flags = line.partition(',')
+        if 'K' in flags and pts_time != 'N/A':
+            keyframes.append(float(pts_time) - offset)
+    keyframes.sort()
+    return keyframes
+
+
+def get_pieces(segments, keyframes):
+    'Splits unredacted segments into (start, end, copy) pieces. The stretch '
+    'between the first and last keyframes in a segment can be stream copied; '
+    'the partial GOPs either side of it have to be re-encoded. Copied pieces '
+    'always start on a keyframe at or after the segment start, so nothing '
+    'from before it can be copied in.'
+    pieces = []
+    for start, end in segments:
+        first = bisect_left(keyframes, start)
+        if end is None:
+            last = len(keyframes) - 1
+        else:
+            last = bisect_right(keyframes, end + KEYFRAME_SLOP) - 1
+        if first > last or (end is not None and keyframes[first] >= end):
+            pieces.append((start, end, False))
+            continue
+        copy_start = keyframes[first]
+        copy_end = None if end is None else keyframes[last]
+        # Less than a frame before the keyframe is dropped rather than
+        # encoded as an empty piece
+        if copy_start - start > KEYFRAME_SLOP:
+            pieces.append((start, copy_start, False))
+        if copy_end is not None and end - copy_end <= KEYFRAME_SLOP:
+            copy_end = end
+        if copy_end is None or copy_end > copy_start:
+            pieces.append((copy_start, copy_end, True))
+        if copy_end is not None and copy_end < end:
+            pieces.append((copy_end, end, False))
+    return pieces
+
+
+def make_smart_file(file, redactions, outfile, encode_args=None, quiet=False):
+    'Makes a redacted copy of file that only re-encodes the GOPs around each '
+    'cut, stream copying the rest and joining the pieces with the concat '
+    'demuxer. The source needs to be in a codec fit for access copies. '
+    'Returns the progress block of the final join.'
+    file = Path(file)
+    encode_args = SMART_VIDEO_ARGS if encode_args is None else encode_args
+    segments = get_segments(redactions)
+    pieces = get_pieces(segments, get_keyframes(file))
+    if outfile.exists():
+        outfile.unlink()
+    with tempfile.TemporaryDirectory(dir=outfile.parent) as tmp:
+        listing = Path(tmp, 'pieces.txt')
+        names = []
+        for num, (start, end, copy) in enumerate(pieces):
+            piece = Path(tmp, f'{num}.ts')
+            seek = start + SEEK_EPSILON if copy else start
+            args = ['ffmpeg', '-ss', str(seek), '-i', str(file)]
+            if end is not None:
+                args += ['-t', str(end - seek)]
+            if copy:
+                args += ['-c', 'copy', '-avoid_negative_ts', 'make_zero']
+            else:
+                args += encode_args
+            args.append(str(piece))
+            run_ffmpeg(args, quiet=quiet)
+            names.append(f"file '{piece.name}'")
+        listing.write_text('\n'.join(names) + '\n')
+        args = [
+            'ffmpeg', '-f', 'concat', '-safe', '0',
+            '-i', str(listing), '-c', 'copy', '-bsf:a', 'aac_adtstoasc',
+            '-movflags', '+faststart', str(outfile)]
+        return run_ffmpeg(args, quiet=quiet)
+
+
+def main(file, redactions=None, crf=None, output_args=None, outfile=None, smart=False, threads=None, quiet=False, cache=None, derivatives=None):
+    'Makes an access file by the cheapest pipeline that suits file and '
+    'returns the job summary from job_summary.'
+    start = time.perf_counter()
+    file = Path(file)
+    if cache is None:
+        cache = probe_cache(None)
+    info = cache.get(file)
     if redactions is not None:
         redactions = [[conv_to_seconds(i) for i in r.split('-')] for r in redactions]
-    if crf is not None:
-        i = DEFAULT_VIDEO_ARGS.index('-crf')
-        DEFAULT_VIDEO_ARGS[i + 1] = crf
-    if file.suffix == '.mxf':
-        make_access_file(
-            file, redactions=redactions, input_args=INPUT_SAMMA_ARGS,
-            output_args=DEFAULT_VIDEO_ARGS, outfile=outfile)
+    if derivatives:
+        video_args = list(DEFAULT_VIDEO_ARGS)
+        audio_args = list(DEFAULT_AUDIO_ARGS)
+        if crf is not None:
+            video_args[video_args.index('-crf') + 1] = str(crf)
+        if threads is not None:
+            video_args += ['-threads', str(threads)]
+            audio_args += ['-threads', str(threads)]
+        outfiles, progress = make_derivatives(
+            file, info, derivatives, redactions=redactions,
+            video_args=video_args, audio_args=audio_args, outfile=outfile,
+            quiet=quiet)
+        return job_summary(
+            file, outfiles, progress, time.perf_counter() - start)
+    pipeline = choose_pipeline(info, redactions, smart)
+    if smart and pipeline != 'smart' and redactions is not None:
+        print(f'Cannot smart cut {file.name}, transcoding it instead')
+    video = pipeline != 'audio'
+    audio = info['audio'] is not None
+    if pipeline == 'copy':
+        args = ['-c', 'copy', '-movflags', '+faststart']
+    elif video:
+        args = list(DEFAULT_VIDEO_ARGS)
+        if crf is not None:
+            args[args.index('-crf') + 1] = str(crf)
+    else:
+        args = list(DEFAULT_AUDIO_ARGS)
+    if threads is not None and pipeline != 'copy':
+        args += ['-threads', str(threads)]
+    if pipeline == 'smart':
+        encode_args = list(SMART_VIDEO_ARGS)
+        if crf is not None:
+            encode_args[encode_args.index('-crf') + 1] = str(crf)
+        if threads is not None:
+            encode_args += ['-threads', str(threads)]
+        if outfile is None:
+            outfile = Path(file.parent, file.stem + '.access.mp4')
+        progress = make_smart_file(
+            file, redactions, Path(outfile), encode_args=encode_args,
+            quiet=quiet)
+        return job_summary(
+            file, outfile, progress, time.perf_counter() - start)
+    input_args = None
+    if info['video'] == 'jpeg2000':
+        input_args = INPUT_SAMMA_ARGS
+    outfile, progress = make_access_file(
+        file, redactions=redactions, input_args=input_args,
+        output_args=args, outfile=outfile, video=video, quiet=quiet,
+        audio=audio)
+    return job_summary(file, outfile, progress, time.perf_counter() - start)
+
+
+def split_redactions(value):
+    'Splits a manifest redactions value such as "0:01:00-0:02:30; 400-410" '
+    'into a list of start-end strings.'
+    if value is None or isinstance(value, list):
+        return value or None
+    return re.split(r'[\s;,]+', value.strip()) if value.strip() else None
+
+
+def read_manifest(path):
+    'Reads a CSV or JSON manifest of items to redact. Each item has a file '
+    'and optionally redactions, output and crf; JSON is a list of objects '
+    'with the same keys.'
+    path = Path(path)
+    if path.suffix.lower() == '.json':
+        with open(path, encoding='utf-8') as f:
+            rows = json.load(f)
     else:
-        make_access_file(
-            file, redactions=redactions,
-            output_args=args, outfile=outfile, video=video)
+        with open(path, encoding='utf-8-sig', newline='') as f:
+            rows = list(csv.DictReader(f))
+    items = []
+    for row in rows:
+        if not isinstance(row, dict):
+            row = {'file': row}
+        # Values are checked per item by redact_item, so one bad entry
+        # fails on its own rather than stopping the batch
+        items.append({
+            'file': row.get('file'),
+            'redactions': row.get('redactions'),
+            'output': row.get('output') or None,
+            'crf': row.get('crf') or None})
+    return items
+
+
+def redact_item(item, crf=None, smart=False, threads=None, retries=1, cache=None, derivatives=None):
+    'Runs one manifest item, retrying failed ffmpeg runs. Returns a report '
+    'dict rather than raising so one bad file does not stop a batch.'
+    report = dict.fromkeys(REPORT_FIELDS, '')
+    report.update(
+        file=item.get('file'), output=item.get('output'), attempts=0)
+    try:
+        found = Path(item['file']).is_file()
+        redactions = split_redactions(item.get('redactions'))
+    except Exception as e:
+        report['status'] = 'failed'
+        report['error'] = f'bad manifest entry, {type(e).__name__}: {e}'
+        return report
+    if not found:
+        report['status'] = 'failed'
+        report['error'] = 'input file not found'
+        return report
+    for attempt in range(retries + 1):
+        report['attempts'] = attempt + 1
+        try:
+            summary = main(
+                item['file'], redactions=redactions,
+                crf=item['crf'] or crf, outfile=item['output'], smart=smart,
+                threads=threads, quiet=True, cache=cache,
+                derivatives=derivatives)
+        except subprocess.CalledProcessError as e:
+            report['status'] = 'failed'
+            report['error'] = f'ffmpeg exited with {e.returncode}'
+            continue
+        except Exception as e:
+            # Missing files, bad timecodes and the like won't improve on a
+            # retry
+            report['status'] = 'failed'
+            report['error'] = f'{type(e).__name__}: {e}'
+            break
+        report['status'] = 'ok'
+        report['error'] = ''
+        report.update(summary)
+        break
+    return report
+
+
+def write_report(path, reports):
+    'Writes the batch reports to a CSV file.'
+    with open(path, 'w', encoding='utf-8', newline='') as f:
+        writer = csv.DictWriter(f, REPORT_FIELDS)
+        writer.writeheader()
+        writer.writerows(reports)
+
+
+def run_batch(items, jobs=2, crf=None, smart=False, retries=1, cache=None, derivatives=None):
+    'Redacts manifest items with up to jobs ffmpeg processes at once, '
+    'splitting the cores between them. Reports come back in manifest order.'
+    threads = max(1, (os.cpu_count() or 1) // jobs)
+    if cache is None:
+        cache = probe_cache(None)
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        futures = [
+            pool.submit(
+                redact_item, item, crf, smart, threads, retries, cache,
+                derivatives)
+            for item in items]
+        reports = []
+        for future in futures:
+            report = future.result()
+            reports.append(report)
+            if report['status'] == 'ok':
+                print_summary(report['file'], report)
+            else:
+                print(report['file'], report['status'], report['error'])
+    failed = sum(r['status'] != 'ok' for r in reports)
+    print(f'{len(reports) - failed} of {len(reports)} files redacted')
+    return reports
+
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(
         description='Simple wrappper script to create a redacted mpeg4 or mp3'
         ' file using ffmpeg. Requires the ffmpeg executable to be on PATH')
-    parser.add_argument('input', metavar='i', help='input av file')
+    parser.add_argument('input', metavar='i', nargs='?', help='input av file')
     parser.add_argument(
         '--redactions', '-r', nargs='+',
         help='start and end of any redactions (in seconds or HH:MM:SS format)')
@@ -132,8 +638,51 @@ if __name__ == '__main__':
     parser.add_argument(
         '--crf',
         help='crf value for ffmpeg. Default is 23, lower is higher quality')
+    parser.add_argument(
+        '--smart', action='store_true',
+        help='only re-encode around the redactions and stream copy the rest. '
+        'Needs H.264 input; anything else is transcoded as usual')
+    parser.add_argument(
+        '--derivatives', '-d', nargs='+', choices=DERIVATIVES,
+        help='make several access copies from one decode: any of an mp4, an '
+        f'mp3 and poster frames every {POSTER_INTERVAL} seconds')
+    parser.add_argument(
+        '--manifest', '-m',
+        help='CSV or JSON manifest of files to redact, with file, redactions '
+        'and optional output and crf columns, instead of a single input')
+    parser.add_argument(
+        '--jobs', '-j', type=int, default=2,
+        help='ffmpeg processes to run at once for a manifest. Default is 2')
+    parser.add_argument(
+        '--report',
+        help='CSV file to write a status and throughput line per manifest '
+        'item to')
+    parser.add_argument(
+        '--probe-cache', default=PROBE_CACHE,
+        help=f'JSON file to keep ffprobe results in between runs. Default is '
+        f'{PROBE_CACHE}')
+    parser.add_argument(
+        '--no-probe-cache', action='store_true',
+        help='probe every file afresh and keep nothing')
+    parser.add_argument(
+        '--retries', type=int, default=1,
+        help='times to retry a failed ffmpeg run in a manifest. Default is 1')
 
     args = parser.parse_args()
-    main(
-        args.input, redactions=args.redactions,
-        crf=args.crf, outfile=args.output)
+    cache = probe_cache(None if args.no_probe_cache else args.probe_cache)
+    if args.manifest is not None:
+        reports = run_batch(
+            read_manifest(args.manifest), jobs=args.jobs, crf=args.crf,
+            smart=args.smart, retries=args.retries, cache=cache,
+            derivatives=args.derivatives)
+        if args.report is not None:
+            write_report(args.report, reports)
+    elif args.input is not None:
+        summary = main(
+            args.input, redactions=args.redactions,
+            crf=args.crf, outfile=args.output, smart=args.smart, cache=cache,
+            derivatives=args.derivatives)
+        print_summary(args.input, summary)
+    else:
+        parser.error('give an input file or a --manifest')
+    cache.save()
@@ -1,10 +1,17 @@
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 import os
 import re
 import shutil
 import subprocess
+import threading
 import argparse
 
+import walker
+
+COPY_THREADS = 8
+JPEG_JOBS = os.cpu_count() or 1
+
 def id_transform(number):
     idents = re.findall(r'(\d{4})[,_.-](\d{2,4})[,_.-](\d{1,5})', number)
     if len(idents) == 1:
@@ -27,33 +34,141 @@ def create_jpeg(fpath, outdir):
     return outfile
 
 
-def move_image(fpath, base_dir, ident):
+def page_name(ident, page, suffix):
+    return '-'.join(ident.split('.'))+'-'+'0'*(5-len(str(page)))+str(page)+suffix
+
+
+class pages(object):
+    '''Hands out page numbers for images of each identifier and file type.
+    Each destination folder is listed once, the first time it is needed, and
+    pages are remembered as they are handed out. Each page is reserved by
+    creating its file exclusively, so workers in other processes writing
+    under the same identifier can't be given it too'''
+    def __init__(self):
+        self.used = {}
+        self.next = {}
+        self.lock = threading.Lock()
+
+    def _load(self, newpath, ident, suffix):
+        newpath.mkdir(parents=True, exist_ok=True)
+        prefix = '-'.join(ident.split('.'))+'-'
+        used = set()
+        with os.scandir(newpath) as it:
+            for entry in it:
+                name = entry.name
+                if name.startswith(prefix) and name.endswith(suffix):
+                    page = name[len(prefix):len(name)-len(suffix)]
+                    if page.isdigit():
+                        used.add(int(page))
+        return used
+
+    def allocate(self, fpath, base_dir, ident):
+        fpath = Path(fpath)
+        newpath = Path(base_dir, *ident.split('.'), fpath.suffix.upper().strip('.'))
+        key = (newpath, fpath.suffix)
+        with self.lock:
+            if key not in self.used:
+                self.used[key] = self._load(newpath, ident, fpath.suffix)
+            used = self.used[key]
+            page = self.next.get(key, 1)
+            while True:
+                while page in used:
+                    page += 1
+                used.add(page)
+                new_dest = newpath / page_name(ident, page, fpath.suffix)
+                try:
+                    fd = os.open(new_dest, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+                except FileExistsError:
+                    continue
+                os.close(fd)
+                break
+            self.next[key] = page + 1
+        return new_dest
+
+
+def copy_image(fpath, new_dest):
     fpath = Path(fpath)
-    newpath = Path(base_dir, *ident.split('.'), fpath.suffix.upper().strip('.'))
-    if not newpath.exists():
-        newpath.mkdir(parents=True)
-    page = 1
-    new_fname = '-'.join(ident.split('.'))+'-'+'0'*(5-len(str(page)))+str(page)+fpath.suffix
-    new_dest = newpath / new_fname
-    while new_dest.exists():
-        page += 1
-        new_fname = '-'.join(ident.split('.'))+'-'+'0'*(5-len(str(page)))+str(page)+fpath.suffix
-        new_dest = newpath / new_fname
     shutil.copy2(fpath, new_dest)
-    print(fpath.name, '->', new_fname)
+    print(fpath.name, '->', new_dest.name)
     return new_dest
 
 
-def main(image_dir, dest_dir, exts=['.tif', '.tiff'], jpeg_dir=None):
-    for root, _, files in os.walk(image_dir):
-        for file in files:
-            id = id_transform(file)
+def move_image(fpath, base_dir, ident, allocator=None):
+    if allocator is None:
+        allocator = pages()
+    return copy_image(fpath, allocator.allocate(fpath, base_dir, ident))
+
+
+class pipeline(object):
+    '''Runs copies to the DAM store on a pool of I/O threads and feeds each
+    finished copy to a pool of JPEG jobs. Each stage has a bounded number of
+    items waiting, so a slow stage holds back the ones before it instead of
+    queueing the whole batch'''
+    def __init__(self, jpeg_dir=None, copy_threads=COPY_THREADS, jpeg_jobs=JPEG_JOBS):
+        self.jpeg_dir = jpeg_dir
+        self.copies = ThreadPoolExecutor(max_workers=copy_threads)
+        # magick does the work in its own process, so threads are enough to
+        # keep one job per core busy
+        self.jpegs = ThreadPoolExecutor(max_workers=jpeg_jobs)
+        self.copy_slots = threading.BoundedSemaphore(copy_threads * 2)
+        self.jpeg_slots = threading.BoundedSemaphore(jpeg_jobs * 2)
+        self.failures = []
+
+    def _done(self, future, fpath, slots):
+        slots.release()
+        if future.exception() is not None:
+            self.failures.append((fpath, future.exception()))
+
+    def _copy(self, fpath, new_dest):
+        try:
+            copy_image(fpath, new_dest)
+        except BaseException:
+            # Give back the page reserved for it
+            new_dest.unlink(missing_ok=True)
+            raise
+        if self.jpeg_dir is not None:
+            self.jpeg_slots.acquire()
+            future = self.jpegs.submit(create_jpeg, new_dest, self.jpeg_dir)
+            future.add_done_callback(
+                lambda f: self._done(f, new_dest, self.jpeg_slots))
+
+    def submit(self, fpath, new_dest):
+        '''Queues one image, blocking while the copy stage is full'''
+        self.copy_slots.acquire()
+        future = self.copies.submit(self._copy, fpath, new_dest)
+        future.add_done_callback(
+            lambda f: self._done(f, fpath, self.copy_slots))
+
+    def close(self):
+        '''Waits for both stages to finish and returns any failures'''
+        self.copies.shutdown(wait=True)
+        self.jpegs.shutdown(wait=True)
+        return self.failures
+
+
+def main(image_dir, dest_dir, exts=['.tif', '.tiff'], jpeg_dir=None, threads=walker.THREADS, copy_threads=COPY_THREADS, jpeg_jobs=JPEG_JOBS):
+    allocator = pages()
+    stages = pipeline(jpeg_dir, copy_threads=copy_threads, jpeg_jobs=jpeg_jobs)
+    try:
+        # Sorted, and pages allocated here rather than in the workers, so
+        # that page numbers come out the same however the share lists and
+        # however the copies finish
+        for entry in walker.walk(
+                image_dir, exts, ignore_case=True, threads=threads, sort=True):
+            id = id_transform(entry.name)
             if id is not None:
-                fpath = Path(root, file)
-                if fpath.suffix.lower() in exts:
-                    new_image = move_image(fpath, dest_dir, id)
-                    if jpeg_dir is not None:
-                        create_jpeg(new_image, jpeg_dir)
+                new_dest = allocator.allocate(entry.path, dest_dir, id)
+                try:
+                    stages.submit(entry.path, new_dest)
+                except BaseException:
+                    # Interrupted while waiting for a copy slot; don't leave
+                    # the reserved page behind as an empty file
+                    new_dest.unlink(missing_ok=True)
+                    raise
+    finally:
+        failures = stages.close()
+    for fpath, error in failures:
+        print('Failed:', fpath, error)
 
 
 if __name__ == '__main__':
@@ -69,7 +184,19 @@ if __name__ == '__main__':
     parser.add_argument(
         '--extensions', '-e', nargs='+', default=['.tif', '.tiff'],
         help='extensions of files to be restructured')
+    parser.add_argument(
+        '--threads', '-t', type=int, default=walker.THREADS,
+        help='directories to list at once')
+    parser.add_argument(
+        '--copy-threads', type=int, default=COPY_THREADS,
+        help='images to copy at once')
+    parser.add_argument(
+        '--jpeg-jobs', type=int, default=JPEG_JOBS,
+        help='jpegs to make at once, defaults to the number of CPUs')
     args = parser.parse_args()
 
 
-    main(args.indir, args.outdir, exts=args.extensions, jpeg_dir=args.jpeg)
+    main(
+        args.indir, args.outdir, exts=args.extensions, jpeg_dir=args.jpeg,
+        threads=args.threads, copy_threads=args.copy_threads,
+        jpeg_jobs=args.jpeg_jobs)
@@ -1,9 +1,16 @@
+from array import array
+from collections import Counter, namedtuple
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
+from functools import lru_cache
 import calendar
+import csv
 import re
 import argparse
 from pathlib import Path
 
+import delimited
+
 
 MONTHS = list(calendar.month_name)[1:]
 MONTHS.extend(list(calendar.month_abbr)[1:])
@@ -25,21 +32,62 @@ DELIM_RE = re.compile('('+DAY+DELIM+MONTHNUM_GROUP+DELIM+YEAR+')', flags=re.IGNO
 MDELIM_RE = re.compile('('+CIRCA+MONTHNUM_GROUP+DELIM+YEAR+')', flags=re.IGNORECASE)
 YEAR_RE = re.compile(r"("+CIRCA+YEAR+"(?P<DECADE>s)?)", flags=re.IGNORECASE)
 
+# Every date form in order of precedence. Group names are prefixed with the
+# form name so all forms can share one alternation and be found in a single
+# left to right pass.
+FORM_RES = [
+    ('DAYRANGE', DAY_RANGE_RE), ('REVDAYRANGE', REV_DAY_RANGE_RE),
+    ('MONTHRANGE', MONTH_RANGE_RE), ('DELIM', DELIM_RE),
+    ('MDELIM', MDELIM_RE), ('YEAR', YEAR_RE)]
+FORM_GROUPS = {
+    form: [(name, form + '_' + name) for name in regex.groupindex]
+    for form, regex in FORM_RES}
+DATE_RE = re.compile('|'.join(
+    '(?P<{}>{})'.format(form, re.sub(
+        r'\(\?P<(\w+)>', '(?P<' + form + r'_\1>', regex.pattern))
+    for form, regex in FORM_RES), flags=re.IGNORECASE)
+
+MONTH_NUMBERS = {m[:3].lower(): n for n, m in enumerate(calendar.month_name) if m}
+MONTH_DAYS = [0, 31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31]
+
 DAYS = calendar.day_name[:]
 DAYS.extend(calendar.day_abbr[:])
+DAYS_RE = re.compile('|'.join(DAYS))
+SPACES_RE = re.compile(' {2,}')
 EARLIEST = 1800
+CACHE_SIZE = 65536
+CHUNK_SIZE = 10000
+DELIMITED = ('.csv', '.tsv', '.txt')
+
+STATUS_OK = 0
+STATUS_EMPTY = 1
+STATUS_NODATES = 2
+STATUS_INVALID = 3
+STATUS_NAMES = ('ok', 'empty', 'no dates', 'invalid')
+UNDATED = ('Undated', None, None)
+
+datecolumns = namedtuple('datecolumns', ['text', 'earliest', 'latest', 'status'])
 LATEST = datetime.now().year
 
 class circadate(datetime):
-    """Class to express fudgy dates"""
+    """Class to express fudgy dates. Like datetime it is immutable, so
+    parsed dates can be cached and shared"""
+    __slots__ = ('circa', 'no_day', 'no_month')
 
     def __new__(cls, year, month=1, day=1, hour=0, minute=0, second=0, circa=False, no_day=False, no_month=False):
-        if LATEST > year > EARLIEST:
-            new = super().__new__(cls, year, month, day)
-            new.circa = circa
-            new.no_day = no_day
-            new.no_month = no_month
-            return new
+        new = super().__new__(cls, year, month, day)
+        object.__setattr__(new, 'circa', circa)
+        object.__setattr__(new, 'no_day', no_day)
+        object.__setattr__(new, 'no_month', no_month)
+        return new
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"circadate is immutable, can't set {name}")
+
+    def __reduce_ex__(self, protocol):
+        return (self.__class__, (
+            self.year, self.month, self.day, 0, 0, 0,
+            self.circa, self.no_day, self.no_month))
 
     def __str__(self):
         if self.no_day:
@@ -55,27 +103,20 @@ class circadate(datetime):
     def __repr__(self):
         return f"<circadate {str(self)}>"
 
-    @classmethod
-    def strptime(cls, date_string, format, circa=False, no_day=False, no_month=False):
-        import _strptime
-        try:
-            new = _strptime._strptime_datetime(cls, date_string, format)
-            new.circa = circa
-            new.no_day = no_day
-            new.no_month = no_month
-            if LATEST > new.year > EARLIEST:
-                return new
-        except Exception:
-            print("Failed to convert", date_string, "to date")
-            return None
-
 
 class daterange(object):
-    """Class to express a date range"""
+    """Class to express a date range. Immutable, like circadate"""
+    __slots__ = ('earliest', 'latest')
 
     def __init__(self, *dates):
-        self.earliest = min(dates)
-        self.latest = max(dates)
+        object.__setattr__(self, 'earliest', min(dates))
+        object.__setattr__(self, 'latest', max(dates))
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"daterange is immutable, can't set {name}")
+
+    def __reduce__(self):
+        return (self.__class__, (self.earliest, self.latest))
 
     def __str__(self):
         if str(self.earliest) == str(self.latest):
@@ -106,183 +147,406 @@ class daterange(object):
             self.latestcolumn(circa_margin))
 
 
+def norm_cell(value):
+    """Normalises a cell value into the key used by parse_date"""
+    return str(value).replace('\n', ' ').strip()
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def parse_date(text, earliest=EARLIEST):
+    """Cached strip_days and pull_dates for a cell normalised by norm_cell.
+    Catalogue columns repeat the same values many times over, so most cells
+    are answered from the cache. Returns a (daterange, failures) tuple;
+    daterange is None if there are no dates in text. Use
+    parse_date.cache_info() for hit and miss counts"""
+    failures = []
+    dates = pull_dates(strip_days(text), failures=failures, earliest=earliest)
+    return dates, tuple(failures)
+
+
 def strip_days(text):
-    for day in DAYS:
-        text = text.replace(day, '')
-    while '  ' in text:
-        text = text.replace('  ', ' ')
+    text = DAYS_RE.sub('', text)
+    text = SPACES_RE.sub(' ', text)
     text = text.replace(b'\xe2\x80\x93'.decode(), '-')
     return text
 
 
-def pull_dates(text, circa=False):
-    """Extract all potential dates from a block of text and return a
-    daterange object.
+def pull_dates(text, circa=False, failures=None, earliest=EARLIEST, latest=LATEST):
+    """Extract all potential dates between the years earliest and latest
+    from a block of text and return a daterange object. Text is scanned
+    once, left to right; where date forms overlap, the form listed first in
+    FORM_RES wins. Matches that are not real dates are appended to failures
+    if it is given.
     """
     dates = []
-    d, text = dayrange_extract(text)
-    dates.extend(d)
-    d, text = reverse_dayrange_extract(text)
-    dates.extend(d)
-    d, text = monthrange_extract(text)
-    dates.extend(d)
-    d, text = delimited_extract(text)
-    dates.extend(d)
-    d, text = monthdelimited_extract(text)
-    dates.extend(d)
-    d, text = year_extract(text)
-    dates.extend(d)
-    dates = [d for d in dates if d is not None]
+    for match in DATE_RE.finditer(text):
+        form = match.lastgroup
+        vals = {name: match[group] for name, group in FORM_GROUPS[form]}
+        # Dates out of range are dropped below, so aren't failures either
+        in_range = latest > int(vals['YEAR']) > earliest
+        dates.extend(FORM_DATES[form](
+            vals, match[0], failures if in_range else None))
+    dates = [d for d in dates if d is not None and latest > d.year > earliest]
     if dates != []:
         return daterange(*dates)
 
-def norm_day(day):
-    return '0' * (2-len(day))+day
-
-
-def dayrange_extract(text):
-    """Extracts dates from text in the form of  12 January 1982, 1-12 Jan,1982
-    etc"""
+def make_date(year, month=1, day=1, text=None, failures=None, **flags):
+    """Builds a circadate straight from matched fields. Days and months
+    that don't exist give None and are noted in failures"""
+    if 1 <= month <= 12:
+        last = MONTH_DAYS[month]
+        if month == 2 and calendar.isleap(year):
+            last += 1
+        if 1 <= day <= last:
+            return circadate(year, month, day, **flags)
+    if failures is not None:
+        failures.append(text)
+    return None
+
+
+def dayrange_dates(vals, text, failures=None):
+    """Dates from text in the form of  12 January 1982, 1-12 Jan,1982 etc.
+    Falls back to the month if a day is not valid for it"""
     dates = []
-    for date in DAY_RANGE_RE.finditer(text):
-        vals = date.groupdict()
-        fstring = "%d %b %Y"
-        dstring = f"{norm_day(vals['DAY'])} {vals['MONTH'][:3].title()} {vals['YEAR']}"
-        dates.append(circadate.strptime(dstring, fstring))
-        if vals['DAY2'] is not None:
-            dstring = f"{norm_day(vals['DAY2'])} {vals['MONTH'][:3].title()} {vals['YEAR']}"
-            dates.append(circadate.strptime(dstring, fstring))
-            text = text.replace(date[0], '')
-    return dates, text
-
-
-def reverse_dayrange_extract(text):
-    """Extracts dates in  the form of jan 6 1978, aug 8-9 1876 etc."""
-    dates = []
-    for date in REV_DAY_RANGE_RE.finditer(text):
-        vals = date.groupdict()
-        fstring = "%d %b %Y"
-        dstring = f"{norm_day(vals['DAY'])} {vals['MONTH'][:3].title()} {vals['YEAR']}"
-        dates.append(circadate.strptime(dstring, fstring))
-        if vals['DAY2'] is not None:
-            dstring = f"{norm_day(vals['DAY2'])} {vals['MONTH'][:3].title()} {vals['YEAR']}"
-            dates.append(circadate.strptime(dstring, fstring))
-            text = text.replace(date[0], '')
-    return dates, text
-
-
-def monthrange_extract(text):
-    """Extracts dates from text in the form of  January 1982, Jan, 1982,
-    aug-sep 1765 etc"""
-    dates = []
-    for date in MONTH_RANGE_RE.finditer(text):
-        vals = date.groupdict()
-        fstring = "%b %Y"
-        dstring = f"{vals['MONTH'][:3].title()} {vals['YEAR']}"
-        dates.append(circadate.strptime(dstring, fstring, no_day=True))
-        if vals['MONTH2'] is not None:
-            dstring = f"{vals['MONTH2'][:3].title()} {vals['YEAR']}"
-            dates.append(circadate.strptime(dstring, fstring, no_day=True))
-        text = text.replace(date[0], '')
-    return dates, text
-
-
-def delimited_extract(text):
-    """Extracts dates from text in the form of  1/1/1982, 1.1.1982 etc"""
-    dates = []
-    for date in DELIM_RE.finditer(text):
-        vals = date.groupdict()
-        dates.append(
-            circadate(
-                int(vals['YEAR']),
-                int(vals['MONTHNUM']),
-                int(vals['DAY'])))
-        text = text.replace(date[0], '')
-    return dates, text
-
-
-def monthdelimited_extract(text):
-    """Extracts dates from text in the form of  12/1982, 6.1982 etc"""
-    dates = []
-    for date in MDELIM_RE.finditer(text):
-        vals = date.groupdict()
-        dates.append(circadate(int(vals['YEAR']), int(vals['MONTHNUM']), no_day=True))
-        text = text.replace(date[0], '')
-    return dates, text
-
-
-def year_extract(text):
-    """Extracts a year or decade from text in the form of 1982, c.1982, 1980s
+    year = int(vals['YEAR'])
+    month = MONTH_NUMBERS[vals['MONTH'][:3].lower()]
+    for day in (vals['DAY'], vals['DAY2']):
+        if day is not None:
+            date = make_date(year, month, int(day), text, failures)
+            if date is None:
+                date = make_date(year, month, no_day=True)
+            dates.append(date)
+    return dates
+
+
+def monthrange_dates(vals, text, failures=None):
+    """Dates from text in the form of  January 1982, Jan, 1982, aug-sep 1765
     etc"""
     dates = []
-    for date in YEAR_RE.finditer(text):
-        vals = date.groupdict()
-        circa = False
-        if vals['CIRCA'] is not None:
-            circa = True
-        if vals['DECADE'] is not None:
-            earliest = int(vals['YEAR'])
-            latest = earliest + 10
-            dates.append(circadate(earliest, no_month=True))
-            dates.append(circadate(latest, no_month=True))
-        else:
-            dates.append(circadate(int(vals['YEAR']), no_month=True, circa=circa))
-    return dates, text
-
-
-def main(workbookpath, column='EADUnitDate', cmargin=5):
+    year = int(vals['YEAR'])
+    for month in (vals['MONTH'], vals['MONTH2']):
+        if month is not None:
+            dates.append(make_date(
+                year, MONTH_NUMBERS[month[:3].lower()], no_day=True))
+    return dates
+
+
+def delimited_dates(vals, text, failures=None):
+    """Dates from text in the form of  1/1/1982, 1.1.1982 etc"""
+    return [make_date(
+        int(vals['YEAR']), int(vals['MONTHNUM']), int(vals['DAY']),
+        text, failures)]
+
+
+def monthdelimited_dates(vals, text, failures=None):
+    """Dates from text in the form of  12/1982, 6.1982 etc"""
+    return [make_date(
+        int(vals['YEAR']), int(vals['MONTHNUM']), no_day=True)]
+
+
+def year_dates(vals, text, failures=None):
+    """A year or decade from text in the form of 1982, c.1982, 1980s etc"""
+    circa = False
+    if vals['CIRCA'] is not None:
+        circa = True
+    if vals['DECADE'] is not None:
+        earliest = int(vals['YEAR'])
+        latest = earliest + 10
+        return [
+            make_date(earliest, no_month=True),
+            make_date(latest, no_month=True)]
+    else:
+        return [make_date(int(vals['YEAR']), no_month=True, circa=circa)]
+
+
+# Jan 6 1978, aug 8-9 1876 etc. carry the same groups as 12 January 1982
+FORM_DATES = {
+    'DAYRANGE': dayrange_dates, 'REVDAYRANGE': dayrange_dates,
+    'MONTHRANGE': monthrange_dates, 'DELIM': delimited_dates,
+    'MDELIM': monthdelimited_dates, 'YEAR': year_dates}
+
+
+def convert(value, cmargin=5, earliest=EARLIEST):
+    """Converts a date cell. Returns the EADUnitDate, EADUnitDateEarliest and
+    EADUnitDateLatest values, a STATUS code and the failures from parse_date"""
+    if value is None:
+        return UNDATED, STATUS_EMPTY, ()
+    if isinstance(value, datetime):
+        dates = None
+        if LATEST > value.year > earliest:
+            dates = daterange(circadate(value.year, value.month, value.day))
+        failures = ()
+    else:
+        datestring = norm_cell(value)
+        if datestring == '':
+            return UNDATED, STATUS_EMPTY, ()
+        dates, failures = parse_date(datestring, earliest)
+    if dates is not None:
+        return dates.columns(circa_margin=cmargin), STATUS_OK, failures
+    elif failures:
+        return UNDATED, STATUS_INVALID, failures
+    else:
+        return UNDATED, STATUS_NODATES, failures
+
+
+def fix_cell(value, row, cmargin=5, earliest=EARLIEST, verbose=True, counts=None):
+    """Returns the EADUnitDate, EADUnitDateEarliest and EADUnitDateLatest
+    values for a date cell, reporting what was done with it if verbose and
+    counting the outcome in counts"""
+    cols, status, failures = convert(value, cmargin, earliest)
+    if counts is not None:
+        counts[STATUS_NAMES[status]] += 1
+    if not verbose:
+        return cols
+    for failure in failures:
+        print(f"Row {row}: Not a valid date:", failure)
+    if status == STATUS_OK:
+        ds = str(value).replace('\n', ' ')
+        print(f"Row {row}: Converted", ds, "->", *cols)
+    elif status == STATUS_EMPTY:
+        print(f"Row {row}: Empty cell")
+    else:
+        print(f"Row {row}: Found no dates in ", norm_cell(value))
+    return cols
+
+
+def cache_report():
+    info = parse_date.cache_info()
+    print(
+        f"Parsed {info.misses} distinct date values, "
+        f"reused {info.hits} from the cache")
+
+
+def parse_dates(values, cmargin=5, earliest=EARLIEST):
+    """Converts an iterable of date values in one go, without openpyxl.
+    Returns a datecolumns tuple of four parallel columns: the UMA date
+    string, the earliest and latest years (0 where there are none) and a
+    STATUS code for each value"""
+    text = []
+    earliest_col = array('i')
+    latest_col = array('i')
+    status = array('b')
+    for value in values:
+        cols, code, _ = convert(value, cmargin, earliest)
+        text.append(cols[0])
+        earliest_col.append(cols[1] or 0)
+        latest_col.append(cols[2] or 0)
+        status.append(code)
+    return datecolumns(text, earliest_col, latest_col, status)
+
+
+def read_delimited(path):
+    """Yields the rows of a delimited file as lists, sniffing the dialect
+    from a sample at the start of it"""
+    with open(path, encoding='utf-8-sig', newline='') as f:
+        dialect = delimited.sniff(f)
+        yield dialect
+        yield from csv.reader(f, dialect=dialect)
+
+
+def parse_delimited(path, column='EADUnitDate', cmargin=5, chunk_size=CHUNK_SIZE, earliest=EARLIEST):
+    """Streams the date column of a delimited file through parse_dates,
+    yielding a datecolumns tuple for every chunk_size rows"""
+    rows = read_delimited(path)
+    next(rows)
+    col_index = next(rows).index(column)
+    chunk = []
+    for row in rows:
+        chunk.append(row[col_index] if len(row) > col_index else None)
+        if len(chunk) == chunk_size:
+            yield parse_dates(chunk, cmargin, earliest)
+            chunk = []
+    if chunk:
+        yield parse_dates(chunk, cmargin, earliest)
+
+
+def fix_delimited(path, column='EADUnitDate', cmargin=5, earliest=EARLIEST,
+                  verbose=True, counts=None):
+    """Streams a delimited file into a copy with the date columns added
+    after column, in the same way as the workbook modes"""
+    p = Path(path)
+    new_path = p.parent / (p.stem+'_datefixed'+p.suffix)
+    rows = read_delimited(path)
+    dialect = next(rows)
+    header = next(rows)
+    if column not in header:
+        if verbose:
+            print("No", column, "column in", path)
+        return
+    col_index = header.index(column) + 1
+    header[col_index:col_index] = [
+        'EADUnitDate', 'EADUnitDateEarliest', 'EADUnitDateLatest']
+    with open(new_path, 'w', encoding='utf-8-sig', newline='') as f:
+        writer = csv.writer(f, dialect=dialect)
+        writer.writerow(header)
+        for rownum, row in enumerate(rows, 2):
+            if len(row) < col_index:
+                row.extend([''] * (col_index - len(row)))
+            row[col_index:col_index] = fix_cell(
+                row[col_index-1] or None, rownum, cmargin, earliest,
+                verbose, counts)
+            writer.writerow(row)
+    if verbose:
+        cache_report()
+        print("Saved delimited file to", new_path)
+    return new_path
+
+
+def fix_worksheet(ws, column='EADUnitDate', cmargin=5, earliest=EARLIEST,
+                  verbose=True, counts=None):
+    """Inserts the date columns after column in a worksheet open for
+    editing"""
+    date_column = None
+    for cell in ws[1]:
+        if cell.value == column:
+            date_column = cell.column_letter
+            col_index = cell.column
+            break
+    if date_column is not None:
+        ws.insert_cols(col_index+1, 3)
+        ws.cell(1, col_index+1).value = 'EADUnitDate'
+        ws.cell(1, col_index+2).value = 'EADUnitDateEarliest'
+        ws.cell(1, col_index+3).value = 'EADUnitDateLatest'
+        for cell in ws[date_column][1:]:
+            cols = fix_cell(
+                cell.value, cell.row, cmargin, earliest, verbose, counts)
+            for offset, value in enumerate(cols, 1):
+                if value is not None:
+                    ws.cell(cell.row, col_index+offset).value = value
+
+
+def stream_worksheet(ws, out_ws, column='EADUnitDate', cmargin=5,
+                     earliest=EARLIEST, verbose=True, counts=None):
+    """Copies the rows of a read-only worksheet to a write-only one, adding
+    the date columns after column as the rows go past. Only values are
+    copied, not formatting"""
+    rows = ws.iter_rows(values_only=True)
+    header = list(next(rows, ()))
+    if column not in header:
+        out_ws.append(header)
+        for row in rows:
+            out_ws.append(row)
+        return
+    col_index = header.index(column) + 1
+    header[col_index:col_index] = [
+        'EADUnitDate', 'EADUnitDateEarliest', 'EADUnitDateLatest']
+    out_ws.append(header)
+    for rownum, row in enumerate(rows, 2):
+        row = list(row)
+        if len(row) < col_index:
+            row.extend([None] * (col_index - len(row)))
+        row[col_index:col_index] = fix_cell(
+            row[col_index-1], rownum, cmargin, earliest, verbose, counts)
+        out_ws.append(row)
+
+
+def main(workbookpath, column='EADUnitDate', cmargin=5, stream=False,
+         earliest=EARLIEST, verbose=True):
+    """Fixes the dates in one workbook or delimited file and returns a
+    Counter of cell outcomes keyed by STATUS_NAMES"""
+    counts = Counter()
+    if Path(workbookpath).suffix.lower() in DELIMITED:
+        fix_delimited(
+            workbookpath, column=column, cmargin=cmargin, earliest=earliest,
+            verbose=verbose, counts=counts)
+        return counts
     try:
         import openpyxl
     except ImportError:
         print("You don't have openpyxl installed. Try 'pip install openpyxl'")
         exit()
-    wb = openpyxl.open(workbookpath)
-    for ws in wb.worksheets:
-        date_column = None
-        for cell in ws[1]:
-            if cell.value == column:
-                date_column = cell.column_letter
-                col_index = cell.column
-                break
-        if date_column is not None:
-            ws.insert_cols(col_index+1, 3)
-            ws.cell(1, col_index+1).value = 'EADUnitDate'
-            ws.cell(1, col_index+2).value = 'EADUnitDateEarliest'
-            ws.cell(1, col_index+3).value = 'EADUnitDateLatest'
-            for cell in ws[date_column][1:]:
-                if cell.value is not None:
-                    if type(cell.value) == datetime:
-                        date = cell.value
-                        dates = daterange(circadate(date.year, date.month, date.day))
-                    else:
-                        datestring = str(cell.value).replace('\n', ' ')
-                        datestring = strip_days(datestring)
-                        dates = pull_dates(datestring)
-                    if dates is not None:
-                        cols = dates.columns(circa_margin=cmargin)
-                        ds = str(cell.value).replace('\n', ' ')
-                        print(f"Row {cell.row}: Converted", ds, "->", *cols)
-                        ws.cell(cell.row, col_index+1).value = cols[0]
-                        ws.cell(cell.row, col_index+2).value = cols[1]
-                        ws.cell(cell.row, col_index+3).value = cols[2]
-                    else:
-                        print(f"Row {cell.row}: Found no dates in ", datestring)
-                        ws.cell(cell.row, col_index+1).value = 'Undated'
-                else:
-                    print(f"Row {cell.row}: Empty cell")
-                    ws.cell(cell.row, col_index+1).value = 'Undated'
-
     p = Path(workbookpath)
     new_path = p.parent / (p.stem+'_datefixed.xlsx')
-    print("Saving workbook to", new_path)
-    wb.save(new_path)
+    if stream:
+        wb = openpyxl.load_workbook(workbookpath, read_only=True)
+        out = openpyxl.Workbook(write_only=True)
+        for ws in wb.worksheets:
+            stream_worksheet(
+                ws, out.create_sheet(ws.title), column=column,
+                cmargin=cmargin, earliest=earliest, verbose=verbose,
+                counts=counts)
+        wb.close()
+    else:
+        out = openpyxl.open(workbookpath)
+        for ws in out.worksheets:
+            fix_worksheet(
+                ws, column=column, cmargin=cmargin, earliest=earliest,
+                verbose=verbose, counts=counts)
+
+    if verbose:
+        cache_report()
+        print("Saving workbook to", new_path)
+    out.save(new_path)
+    return counts
+
+
+def fix_file(path, column='EADUnitDate', cmargin=5, stream=False,
+             earliest=EARLIEST):
+    """Worker for fix_many. Runs main quietly and returns the path, its
+    counts and any error rather than raising it"""
+    try:
+        return path, main(
+            path, column=column, cmargin=cmargin, stream=stream,
+            earliest=earliest, verbose=False), None
+    except Exception as e:
+        return path, Counter(), f"{type(e).__name__}: {e}"
+
+
+def find_files(paths):
+    """Expands directories in paths to the workbooks and delimited files
+    directly inside them, skipping earlier output and Excel lock files"""
+    found = []
+    for path in paths:
+        p = Path(path)
+        if not p.is_dir():
+            found.append(p)
+            continue
+        for child in sorted(p.iterdir()):
+            if (child.is_file()
+                    and child.suffix.lower() in ('.xlsx',) + DELIMITED
+                    and not child.stem.endswith('_datefixed')
+                    and not child.name.startswith('~$')):
+                found.append(child)
+    return found
+
+
+def fix_many(paths, column='EADUnitDate', cmargin=5, stream=False,
+             earliest=EARLIEST, jobs=None):
+    """Fixes each file in paths in its own process and prints a summary
+    line per file in the order given. Returns a dict of path to counts"""
+    if any(Path(p).suffix.lower() not in DELIMITED for p in paths):
+        try:
+            import openpyxl
+        except ImportError:
+            print("You don't have openpyxl installed. Try 'pip install openpyxl'")
+            exit()
+    results = {}
+    total = Counter()
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        futures = [
+            pool.submit(fix_file, str(p), column, cmargin, stream, earliest)
+            for p in paths]
+        for future in futures:
+            path, counts, error = future.result()
+            results[path] = counts
+            total.update(counts)
+            if error is not None:
+                print(f"{path}: failed, {error}")
+                continue
+            print(f"{path}: " + ', '.join(
+                f"{counts[name]} {name}" for name in STATUS_NAMES))
+    print(f"{len(paths)} files: " + ', '.join(
+        f"{total[name]} {name}" for name in STATUS_NAMES))
+    return results
 
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(
-        description='Fix horrible dates in an Excel spreadsheet')
+        description='Fix horrible dates in Excel or delimited spreadsheets')
     parser.add_argument(
-        'workbook', metavar='i', type=str, help='Workbook with horrible dates')
+        'workbook', metavar='i', type=str, nargs='+',
+        help='Workbooks or .csv, .tsv or .txt files with horrible dates, or '
+        'directories of them')
     parser.add_argument(
         '--datecolumn', '-d', default='EADUnitDate',
         help='Column to extract dates from, defaults to EADUnitDate')
@@ -290,9 +554,24 @@ if __name__ == '__main__':
         '--circamargin', '-c', type=int, default=5,
         help='Margin to place on earliest and latest dates where dates are circa')
     parser.add_argument(
-        '--earliest', '-e', type=int,
+        '--earliest', '-e', type=int, default=EARLIEST,
         help='Earliest possible year for dates extracted')
+    parser.add_argument(
+        '--stream', '-s', action='store_true',
+        help='stream rows into a new workbook instead of editing a copy of '
+        'the original. Much faster on large sheets, but drops formatting')
+    parser.add_argument(
+        '--jobs', '-j', type=int, default=None,
+        help='number of files to fix at once when given several, defaults to '
+        'the number of CPUs')
     args = parser.parse_args()
-    if args.earliest is not None:
-        EARLIEST = args.earliest
-    main(args.workbook, column=args.datecolumn, cmargin=args.circamargin)
+    files = find_files(args.workbook)
+    if len(files) == 1 and files[0] == Path(args.workbook[0]):
+        main(
+            args.workbook[0], column=args.datecolumn,
+            cmargin=args.circamargin, stream=args.stream,
+            earliest=args.earliest)
+    else:
+        fix_many(
+            files, column=args.datecolumn, cmargin=args.circamargin,
+            stream=args.stream, earliest=args.earliest, jobs=args.jobs)
@@ -0,0 +1,25 @@
+'''Dialect sniffing shared by upload_parse and date_fixer.
+
+Sheets are sniffed from a bounded sample at the start of the file so memory
+use stays flat however large they are.
+'''
+import csv
+
+SNIFF_SAMPLE = 64 * 1024
+DELIMITERS = ',\t;|'
+
+
+def sniff(f, sample_size=SNIFF_SAMPLE):
+    '''Returns the dialect of the open text file f, sniffed from a sample cut
+    back to its last whole line, and rewinds f. Raises csv.Error if no
+    delimiter can be found'''
+    sample = f.read(sample_size)
+    if len(sample) == sample_size and '\n' in sample:
+        sample = sample[:sample.rindex('\n')]
+    # On a CRLF sheet whose last column is quoted (the usual Excel export)
+    # the sniffer takes '\r' for the delimiter, so line endings are evened
+    # out and only delimiters a sheet would really use are considered
+    dialect = csv.Sniffer().sniff(
+        sample.replace('\r', ''), delimiters=DELIMITERS)
+    f.seek(0)
+    return(dialect)
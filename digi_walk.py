@@ -2,6 +2,10 @@ import os
 import csv
 import argparse
 import re
+import sqlite3
+import tempfile
+
+import walker
 
 FIELDS = [
     'ObjectType', 'EADLevelAttribute', 'EADUnitID',
@@ -9,75 +13,208 @@ FIELDS = [
     'EADUnitTitle', 'EADUnitDate', 'EADUnitDateEarliest',
     'EADUnitDateLatest', 'EADScopeAndContent', 'AssRelatedPartiesRef_tab.irn',
     'EADUseRestrictions']
+MEDIA_FIELDS = [
+    'Multimedia', 'DetResourceType', 'MulTitle', 'DetSource',
+    'AdmPublishWebNoPassword']
 
 
-class item():
-    def __init__(self, number):
-        p = re.findall(r'\d{4}[,_.-]\d{2,4}[,_.-]\d{1,5}', number)
-        if p == []:
-            return(None)
-        else:
-            self.item_number = self.id_transform(p[0])
-            n = [str(int(i)) for i in self.item_number.split('.')]
-            self.pattern = re.compile(r"[,_.-]0*".join(n)+r'\D+')
-            if os.path.exists(number):
-                self.surrogates = [os.path.abspath(number)]
-            else:
-                self.surrogates = []
+# UMA identifiers, e.g. 1982.0012.00034 or 1982_12_34, not followed by a digit
+ID_RE = re.compile(r'(\d{4})[,_.-](\d{2,4})[,_.-](\d{1,5})(?!\d)')
 
-    def __repr__(self):
-        if hasattr(self, 'item_number'):
-            return("<item {}>".format(self.item_number))
-        else:
-            return("<empty item>")
-
-    def id_transform(self, number):
-        r = re.split(r'[,_.-]', number)
-        if len(r[1]) < 4:
-            pre = 4-len(r[1])
-            r[1] = '0'*pre+r[1]
-        if len(r[2]) < 5:
-            pre = 5-len(r[2])
-            r[2] = '0'*pre+r[2]
-        return('.'.join(r))
-
-    def match(self, filepath):
-        s = self.pattern.findall(filepath)
-        if len(s) > 0 and os.path.abspath(filepath) not in self.surrogates:
-            self.surrogates.append(os.path.abspath(filepath))
-
-
-def add_fields(i, row, publish='yes'):
-    for x, v in enumerate(i.surrogates, start=1):
-        newfields = {
-            'MulMultiMediaRef_tab({}).Multimedia'.format(x): v,
-            'MulMultiMediaRef_tab({}).DetResourceType'.format(x): '',
-            'MulMultiMediaRef_tab({}).MulTitle'.format(x): '',
-            'MulMultiMediaRef_tab({}).DetSource'.format(x): i.item_number,
-            'MulMultiMediaRef_tab({}).AdmPublishWebNoPassword'.format(x):
-            publish}
+
+def id_transform(match):
+    '''Normalises the parts of an ID_RE match to the 0000.0000.00000 form'''
+    year, series, num = match.groups()
+    return('{}.{:0>4}.{:0>5}'.format(year, series, num))
+
+
+def find_id(name, path):
+    '''Returns the normalised identifier in a file name, falling back to the
+    rest of its path, or None'''
+    m = ID_RE.search(name) or ID_RE.search(path)
+    if m is None:
+        return(None)
+    return(id_transform(m))
+
+
+def media_fields(x):
+    '''Returns the multimedia column names for the xth surrogate'''
+    return([
+        'MulMultiMediaRef_tab({}).{}'.format(x, f) for f in MEDIA_FIELDS])
+
+
+def add_fields(ident, surrogates, row, fields, publish='yes'):
+    for x, v in enumerate(surrogates, start=1):
+        newfields = dict(zip(
+            media_fields(x), [v, '', '', ident, publish]))
         for field in newfields.keys():
             if field not in fields:
                 fields.append(field)
         row.update(newfields)
 
 
-def list_items(directory, ext):
-    item_list = {}
-    file_list = []
-    for root, dirs, files in os.walk(directory):
-        file_list.extend([
-            os.path.join(root, file) for file in files
-            if os.path.splitext(file)[1] in ext])
-    for file in file_list:
-        i = item(file)
-        if i.item_number not in item_list.keys():
-            item_list.update({i.item_number: i})
-        else:
-            item_list[i.item_number].match(file)
+def list_items(directory, ext, item_list=None, threads=walker.THREADS):
+    '''Scans one or more directories once and returns a dict of normalised
+    identifier to an insertion-ordered dict of surrogate paths (used as a
+    set), in the same top-down order as os.walk'''
+    if item_list is None:
+        item_list = {}
+    if isinstance(directory, str):
+        directory = [directory]
+    roots = [os.path.abspath(d) for d in directory]
+    for entry in walker.walk(roots, ext, threads=threads):
+        ident = find_id(entry.name, entry.path)
+        if ident is not None:
+            item_list.setdefault(ident, {})[entry.path] = None
     return(item_list)
 
 
+def _scan(item):
+    '''Stats one (path, parent, known mtime) directory for
+    surrogate_index.refresh. Returns None if it has gone, or its mtime and,
+    if that has changed, its surrogates' index rows and subdirectories'''
+    path, parent, known = item
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except OSError:
+        return(None)
+    if mtime == known:
+        return(mtime, None, None)
+    entries, subdirs = walker.list_dir(path)
+    files = []
+    for entry in entries:
+        ident = find_id(entry.name, entry.path)
+        if ident is None:
+            continue
+        try:
+            st = entry.stat()
+        except OSError:
+            continue
+        files.append((
+            entry.path, path, os.path.splitext(entry.name)[1],
+            st.st_size, st.st_mtime_ns, ident))
+    return(mtime, files, [entry.path for entry in subdirs])
+
+
+class surrogate_index(object):
+    '''A persistent SQLite index of the surrogates under one or more
+    directories. refresh only lists directories whose mtime has changed since
+    the last run; unchanged ones are descended through the stored tree'''
+    SCHEMA = '''
+        CREATE TABLE IF NOT EXISTS dirs (
+            path TEXT PRIMARY KEY, parent TEXT, mtime INTEGER);
+        CREATE INDEX IF NOT EXISTS dirs_parent ON dirs (parent);
+        CREATE TABLE IF NOT EXISTS files (
+            path TEXT PRIMARY KEY, dir TEXT, ext TEXT, size INTEGER,
+            mtime INTEGER, ident TEXT);
+        CREATE INDEX IF NOT EXISTS files_ident ON files (ident);
+        CREATE INDEX IF NOT EXISTS files_dir ON files (dir);
+    '''
+
+    def __init__(self, path):
+        self.conn = sqlite3.connect(path)
+        self.conn.executescript(self.SCHEMA)
+
+    def close(self):
+        self.conn.close()
+
+    def _forget(self, path):
+        '''Drops a directory that has gone and everything below it'''
+        prefix = os.path.join(path, '')
+        self.conn.execute(
+            'DELETE FROM dirs WHERE path = ? OR substr(path, 1, ?) = ?',
+            (path, len(prefix), prefix))
+        self.conn.execute(
+            'DELETE FROM files WHERE dir = ? OR substr(dir, 1, ?) = ?',
+            (path, len(prefix), prefix))
+
+    def _known(self, path):
+        row = self.conn.execute(
+            'SELECT mtime FROM dirs WHERE path = ?', (path,)).fetchone()
+        return(None if row is None else row[0])
+
+    def _update(self, item, result):
+        '''Stores what _scan found for one directory and returns the
+        directories below it to scan next'''
+        conn = self.conn
+        path, parent, known = item
+        if result is None:
+            self._forget(path)
+            return([])
+        mtime, files, subdirs = result
+        if files is None:
+            subdirs = [row[0] for row in conn.execute(
+                'SELECT path FROM dirs WHERE parent = ? ORDER BY path',
+                (path,))]
+        else:
+            conn.execute('DELETE FROM files WHERE dir = ?', (path,))
+            conn.executemany(
+                'INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?)',
+                files)
+            gone = {row[0] for row in conn.execute(
+                'SELECT path FROM dirs WHERE parent = ?', (path,))}
+            for old in gone.difference(subdirs):
+                self._forget(old)
+            conn.execute(
+                'INSERT INTO dirs VALUES (?, ?, ?) ON CONFLICT (path) DO '
+                'UPDATE SET mtime = excluded.mtime, '
+                'parent = coalesce(excluded.parent, parent)',
+                (path, parent, mtime))
+        return([(d, path, self._known(d)) for d in subdirs])
+
+    def refresh(self, directory, threads=walker.THREADS):
+        '''Brings the index up to date for directory, statting and listing
+        directories on walker's pool. Returns the number of directories that
+        had to be listed'''
+        path = os.path.abspath(directory)
+        listed = 0
+        for item, result in walker.traverse(
+                [(path, None, self._known(path))], _scan, self._update,
+                threads=threads):
+            if result is not None and result[1] is not None:
+                listed += 1
+        self.conn.commit()
+        return(listed)
+
+    def _where(self, directories, exts):
+        clauses = []
+        params = []
+        for directory in directories:
+            directory = os.path.abspath(directory)
+            prefix = os.path.join(directory, '')
+            clauses.append('dir = ? OR substr(dir, 1, ?) = ?')
+            params.extend([directory, len(prefix), prefix])
+        where = '(' + ' OR '.join(clauses) + ')' if clauses else '1'
+        exts = list(exts)
+        where += ' AND ext IN ({})'.format(', '.join('?' * len(exts)))
+        return(where, params + exts)
+
+    def lookup(self, ident, directories, exts):
+        '''Returns the surrogate paths for one EADUnitID'''
+        where, params = self._where(directories, exts)
+        return([row[0] for row in self.conn.execute(
+            'SELECT path FROM files WHERE ident = ? AND ' + where +
+            ' ORDER BY path', [ident] + params)])
+
+    def idents(self, directories, exts):
+        '''Returns every identifier with surrogates under directories'''
+        where, params = self._where(directories, exts)
+        return([row[0] for row in self.conn.execute(
+            'SELECT DISTINCT ident FROM files WHERE ' + where +
+            ' ORDER BY ident', params)])
+
+    def items(self, directories, exts):
+        '''Returns every identifier and its surrogates under directories, in
+        the same form as list_items'''
+        where, params = self._where(directories, exts)
+        item_list = {}
+        for ident, path in self.conn.execute(
+                'SELECT ident, path FROM files WHERE ' + where +
+                ' ORDER BY ident, path', params):
+            item_list.setdefault(ident, {})[path] = None
+        return(item_list)
+
+
 def write_csv(csv_file, rows, fields):
     with open(csv_file, 'w', newline='', encoding='utf-8-sig') as e:
         writer = csv.DictWriter(e, fieldnames=fields)
@@ -86,32 +223,106 @@ def write_csv(csv_file, rows, fields):
             writer.writerow(row)
 
 
-def main(directory, csv_file, publish='yes', exts=['.jpg', '.pdf']):
-    items = {}
-    for dir in directory:
-        items.update(list_items(dir, exts))
-    if os.path.exists(csv_file):
-        with open(csv_file, newline='', encoding='utf-8-sig') as f:
-            reader = csv.DictReader(f)
-            fields = reader.fieldnames
+def merge_csv(csv_file, lookup, idents, publish='yes', unmatched=False):
+    '''Attaches surrogates to the matching rows of an existing upload sheet,
+    keeping every other row. lookup returns the surrogates for an EADUnitID
+    and idents lists every identifier that has any. The sheet is read twice,
+    first to size the multimedia columns and then to stream rows into a
+    temporary file that replaces it, so the sheet is never held in memory.
+    Returns the identifiers that had no row'''
+    seen = set()
+    most = 0
+    with open(csv_file, newline='', encoding='utf-8-sig') as f:
+        reader = csv.DictReader(f)
+        fields = list(reader.fieldnames)
+        for row in reader:
+            ident = row['EADUnitID']
+            if ident not in seen:
+                surrogates = lookup(ident)
+                if surrogates:
+                    seen.add(ident)
+                    most = max(most, len(surrogates))
+    missing = [k for k in idents if k not in seen]
+    if unmatched:
+        for k in missing:
+            most = max(most, len(lookup(k)))
+    for x in range(1, most+1):
+        fields.extend(f for f in media_fields(x) if f not in fields)
+    out = tempfile.NamedTemporaryFile(
+        'w', newline='', encoding='utf-8-sig', delete=False,
+        dir=os.path.dirname(os.path.abspath(csv_file)), suffix='.csv')
+    try:
+        with out, open(csv_file, newline='', encoding='utf-8-sig') as f:
+            writer = csv.DictWriter(out, fieldnames=fields)
+            writer.writeheader()
+            done = set()
+            for row in csv.DictReader(f):
+                ident = row['EADUnitID']
+                if ident in seen and ident not in done:
+                    done.add(ident)
+                    add_fields(ident, lookup(ident), row, fields, publish)
+                writer.writerow(row)
+            if unmatched:
+                for k in missing:
+                    row = {'EADUnitID': k}
+                    add_fields(k, lookup(k), row, fields, publish)
+                    writer.writerow(row)
+        os.replace(out.name, csv_file)
+    except BaseException:
+        os.unlink(out.name)
+        raise
+    return(missing)
+
+
+def main(directory, csv_file, publish='yes', exts=['.jpg', '.pdf'],
+         index=None, refresh=True, threads=walker.THREADS, unmatched=False):
+    idx = None
+    if index is not None:
+        idx = surrogate_index(index)
+        if refresh:
+            for dir in directory:
+                listed = idx.refresh(dir, threads=threads)
+                print('Listed', listed, 'changed directories in', dir)
+    try:
+        if os.path.exists(csv_file):
+            if idx is not None:
+                # Each row is looked up in the index by EADUnitID; only the
+                # identifiers are loaded, to find those without a row
+                def lookup(ident):
+                    return(idx.lookup(ident, directory, exts))
+                idents = idx.idents(directory, exts)
+            else:
+                items = list_items(directory, exts, threads=threads)
+
+                def lookup(ident):
+                    return(items.get(ident, ()))
+                idents = items
+            missing = merge_csv(
+                csv_file, lookup, idents, publish=publish,
+                unmatched=unmatched)
+            if missing != []:
+                if unmatched:
+                    print('Added rows for unmatched files:')
+                else:
+                    print('Unmatched files:')
+                for k in missing:
+                    print(k)
+                    print(", ".join(lookup(k)))
+        else:
+            if idx is not None:
+                items = idx.items(directory, exts)
+            else:
+                items = list_items(directory, exts, threads=threads)
             rows = []
-            for row in reader:
-                if row['EADUnitID'] in items.keys():
-                    add_fields(items.pop(row['EADUnitID']), row)
-                    rows.append(row)
-        if items != {}:
-            print('Unmatched files:')
+            fields = list(FIELDS)
             for k, v in items.items():
-                print(k)
-                print(", ".join(v.surrogates))
-        write_csv(csv_file, rows, FIELDS)
-    else:
-        rows = []
-        for k, v in items.items():
-            row = {'EADUnitID': k}
-            add_fields(v, row, publish=publish)
-            rows.append(row)
-        write_csv(csv_file, rows, fields)
+                row = {'EADUnitID': k}
+                add_fields(k, v, row, fields, publish=publish)
+                rows.append(row)
+            write_csv(csv_file, rows, fields)
+    finally:
+        if idx is not None:
+            idx.close()
 
 
 if __name__ == '__main__':
@@ -134,6 +345,20 @@ if __name__ == '__main__':
     parser.add_argument(
         '--unmatched', dest='unmatched', default=False,
         action='store_true',
-        help='add additional matched items to the spreadsheet')
+        help='add rows for surrogates with no matching row to the spreadsheet')
+    parser.add_argument(
+        '--index',
+        help='SQLite file to keep a surrogate index in, so later runs only '
+        'rescan directories that have changed')
+    parser.add_argument(
+        '--no-refresh', dest='refresh', default=True, action='store_false',
+        help='use the --index as it is without checking for changes')
+    parser.add_argument(
+        '--threads', '-t', type=int, default=walker.THREADS,
+        help='directories to list at once (default is {})'.format(
+            walker.THREADS))
     args = parser.parse_args()
-    main(args.directory, args.csvfile, publish=args.publish, exts=args.extensions)
+    main(
+        args.directory, args.csvfile, publish=args.publish,
+        exts=args.extensions, index=args.index, refresh=args.refresh,
+        threads=args.threads, unmatched=args.unmatched)
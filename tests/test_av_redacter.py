@@ -0,0 +1,39 @@
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import av_redacter
+
+H264 = {'video': 'h264', 'audio': 'aac', 'pix_fmt': 'yuv420p', 'height': 1080}
+
+
+def test_get_pieces():
+    keyframes = [0.0, 10.0, 20.0, 30.0]
+    assert av_redacter.get_pieces([(5, 25)], keyframes) == [
+        (5, 10.0, False), (10.0, 20.0, True), (20.0, 25, False)]
+    assert av_redacter.get_pieces([(25, None)], keyframes) == [
+        (25, 30.0, False), (30.0, None, True)]
+    assert av_redacter.get_pieces([(12, 18)], keyframes) == [(12, 18, False)]
+
+
+def test_get_pieces_never_copies_before_start():
+    keyframes = [0.0, 30.03]
+    assert av_redacter.get_pieces([(30.01, None)], keyframes) == [
+        (30.03, None, True)]
+
+
+def test_choose_pipeline():
+    assert av_redacter.choose_pipeline(H264) == 'copy'
+    assert av_redacter.choose_pipeline(H264, [[1, 2]]) == 'transcode'
+    assert av_redacter.choose_pipeline(H264, [[1, 2]], True) == 'smart'
+    assert av_redacter.choose_pipeline(
+        dict(H264, video=None), [[1, 2]], True) == 'audio'
+    assert av_redacter.choose_pipeline(
+        dict(H264, audio='pcm_s24le'), [[1, 2]], True) == 'transcode'
+
+
+def test_choose_pipeline_needs_access_pix_fmt_for_smart():
+    info = dict(H264, pix_fmt='yuv422p10le')
+    assert av_redacter.choose_pipeline(info) == 'transcode'
+    assert av_redacter.choose_pipeline(info, [[1, 2]], True) == 'transcode'
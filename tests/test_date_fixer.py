@@ -0,0 +1,43 @@
+import csv
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import date_fixer
+
+
+def test_parse_dates():
+    cols = date_fixer.parse_dates(['c.1920s', '', '12 January 1982', 'nothing'])
+    assert cols.text[2] == '12 January 1982'
+    assert list(cols.earliest[1:]) == [0, 1982, 0]
+    assert list(cols.latest[1:]) == [0, 1982, 0]
+    assert list(cols.status) == [
+        date_fixer.STATUS_OK, date_fixer.STATUS_EMPTY, date_fixer.STATUS_OK,
+        date_fixer.STATUS_NODATES]
+
+
+def test_parse_dates_earliest():
+    assert date_fixer.parse_dates(['1850'], earliest=1900).status[0] == \
+        date_fixer.STATUS_NODATES
+    assert date_fixer.parse_dates(['1850'], earliest=1800).earliest[0] == 1850
+
+
+def test_parse_delimited(tmp_path):
+    path = tmp_path / 'd.csv'
+    path.write_text('EADUnitID,EADUnitDate\n1,1982\n2,\n3,March 1990\n')
+    chunks = list(date_fixer.parse_delimited(path, chunk_size=2))
+    assert [len(c.text) for c in chunks] == [2, 1]
+    assert chunks[0].earliest[0] == 1982
+    assert chunks[1].text[0] == 'March 1990'
+
+
+def test_parse_delimited_crlf_quoted(tmp_path):
+    path = tmp_path / 'excel.csv'
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['EADUnitID', 'EADUnitDate', 'EADScopeAndContent'])
+        for i in range(200):
+            writer.writerow([i, '1982', f'Letters, notes\r\nitem {i}'])
+    chunks = list(date_fixer.parse_delimited(path))
+    assert list(chunks[0].earliest) == [1982] * 200
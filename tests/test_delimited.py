@@ -0,0 +1,21 @@
+import csv
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import delimited
+
+
+def test_sniff_crlf_quoted_last_column(tmp_path):
+    path = tmp_path / 'excel.csv'
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['EADUnitID', 'EADUnitTitle', 'EADScopeAndContent'])
+        for i in range(200):
+            writer.writerow([i, f'Title {i}', f'Letters, notes\r\nitem {i}'])
+    with open(path, newline='') as f:
+        dialect = delimited.sniff(f)
+        assert dialect.delimiter == ','
+        assert next(csv.reader(f, dialect=dialect)) == [
+            'EADUnitID', 'EADUnitTitle', 'EADScopeAndContent']
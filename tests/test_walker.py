@@ -0,0 +1,44 @@
+import os
+import sys
+import threading
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import walker
+
+
+def test_walk_matches_os_walk(tmp_path):
+    for d in ('a/b', 'a/c', 'd'):
+        (tmp_path / d).mkdir(parents=True)
+        for name in ('1.jpg', '2.txt'):
+            (tmp_path / d / name).write_text('')
+    expected = []
+    for dirpath, dirnames, filenames in os.walk(tmp_path):
+        dirnames.sort()
+        expected.extend(
+            os.path.join(dirpath, f) for f in sorted(filenames)
+            if f.endswith('.jpg'))
+    found = [e.path for e in walker.walk(tmp_path, ['.jpg'], sort=True)]
+    assert found == expected
+
+
+def test_traverse_runs_a_bounded_distance_ahead():
+    visited = []
+    lock = threading.Lock()
+
+    def visit(item):
+        with lock:
+            visited.append(item)
+        return(item)
+
+    def expand(item, result):
+        return([item + (i,) for i in range(10)] if len(item) < 4 else [])
+
+    items = walker.traverse([()], visit, expand, threads=2)
+    assert next(items) == ((), ())
+    time.sleep(0.2)
+    assert len(visited) <= 1 + 2 * walker.AHEAD
+    assert sum(1 for _ in items) == 10 + 100 + 1000 + 10000
+    items.close()
@@ -1,12 +1,19 @@
 import csv
+import hashlib
+import json
 import re
 import calendar
 import logging
 import argparse
 import os
-from io import StringIO
-from datetime import datetime, timedelta
+import pickle
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import date, datetime, timedelta
 from collections import Counter
+
+import delimited
+
 FORMAT = '[%(levelname)s] Row %(rownum)s,  Field %(field)s - %(message)s'
 logging.basicConfig(format=FORMAT)
 logger = logging.getLogger('fieldhelp')
@@ -36,295 +43,872 @@ holder_heads = [
     'LocHolderName', 'LocLocationType', 'LocStorageType',
     'LocHolderLocationRef.LocLocationCode']
 
+CHUNK_SIZE = 2000
+MAX_PER_FIELD = 20
+RESOURCE_THREADS = 16
+CACHE_DIR = os.path.join(os.path.expanduser('~'), '.upload_parse_cache')
+
+# code: (level, message) for every finding the checks can report
+MESSAGES = {
+    'blank-heading': (logging.ERROR, 'blank column heading: column {}'),
+    'invalid-heading': (logging.ERROR, 'Invalid column heading: {}'),
+    'invalid-multimedia-heading': (
+        logging.ERROR, 'Invalid multimedia column heading: {}'),
+    'missing-heading': (logging.ERROR, 'Missing mandatory column heading'),
+    'duplicate-heading': (logging.ERROR, 'Duplicate column heading'),
+    'blank-row': (logging.ERROR, 'Blank row'),
+    'row-error': (logging.ERROR, 'Could not check row: {}'),
+    'missing-mandatory': (logging.ERROR, 'Missing mandatory value'),
+    'missing-value': (logging.WARNING, 'Missing mandatory value'),
+    'missing-resource': (logging.ERROR, 'Cannot find resource: {}'),
+    'invalid-publish': (logging.ERROR, 'Invalid value: {}'),
+    'title-mismatch': (
+        logging.WARNING, 'MulTitle does not match EadUnitTitle: {}'),
+    'invalid-location': (logging.WARNING, 'Invalid location attribute: {}'),
+    'excel-date': (logging.WARNING, 'Excel mangled date: {}'),
+    'invalid-date': (logging.WARNING, 'Invalid date format: {}'),
+    'date-order': (
+        logging.WARNING, 'Earliest date later than latest: {}'),
+    'invalid-level': (logging.WARNING, 'Invalid level attribute: {}'),
+    'invalid-id': (logging.WARNING, 'Invalid identifier: {}'),
+    'invalid-parent-id': (logging.WARNING, 'Invalid parent identifier: {}'),
+    'holder-parent-mismatch': (
+        logging.INFO,
+        'Holder name does not match AssParentObjectRef.EADUnitID: {}'),
+    'id-parent-mismatch': (
+        logging.WARNING,
+        'EADUnitID does not match AssParentObjectRef.EADUnitID: {}'),
+    'duplicate-id': (logging.ERROR, 'Duplicate EADUnitID: {}'),
+    'missing-holder': (logging.ERROR, 'Holder not in holder spreadsheet: {}'),
+    'missing-parent': (
+        logging.ERROR,
+        'Parent not found in sheet or existing identifiers: {}'),
+    'parent-not-in-sheet': (
+        logging.INFO,
+        'Parent not found in sheet or existing identifiers: {}'),
+}
+
+
+REG_ID = re.compile(r'\d{4}\.\d{4}\.\d{5}')
+REG_PID = re.compile(r'\d{4}\.\d{4}(\.\d{5})?')
+REG_LOC = re.compile(r'[A-Z]{1,2}\d{1,2}/\d{1,2}')
+REG_MUL = re.compile(r'MulMultiMediaRef_tab(?:\((\d+)\))?\.(.*)')
+REG_WORD = re.compile('[a-z,A-Z]+')
+DATE_WORDS = frozenset(['c', 'Undated'] + list(calendar.month_name))
+LEVELS = ('Item', 'Sub-item', 'Unit')
+
+record_heads = [
+    'EADUnitID', 'EADUnitTitle', 'EADUnitDate', 'EADUnitDateEarliest',
+    'EADUnitDateLatest', 'AssParentObjectRef.EADUnitID',
+    'LocCurrentLocationRef.LocHolderName', 'EADLevelAttribute']
+
 
 def from_excel_ordinal(ordinal, _epoch0=datetime(1899, 12, 31)):
+    '''Returns the date an Excel day number stands for, or None if it is
+    out of range'''
     if ordinal > 59:
         ordinal -= 1  # Excel leap year bug, 1900 is not a leap year!
-    d = (_epoch0 + timedelta(days=ordinal)).replace(microsecond=0)
+    try:
+        d = (_epoch0 + timedelta(days=ordinal)).replace(microsecond=0)
+    except OverflowError:
+        return(None)
     return(d.date().strftime("%d %B %Y"))
 
 
-class multimedia(dict):
-    def __init__(self, row, rownum):
-        super(multimedia, self).__init__(row)
+class BlankRow(ValueError):
+    '''Raised by record for a row with no values'''
+
+
+class diagnostics(object):
+    '''Collects findings as compact (row, field, code, value) tuples.
+    Nothing is formatted until the findings are rendered or written out'''
+
+    def __init__(self, source=''):
+        self.source = source
+        self.findings = []
+
+    def add(self, rownum, field, code, value=''):
+        self.findings.append((rownum, field, code, value))
+
+    def extend(self, findings):
+        self.findings.extend(findings)
+
+    def counts(self):
+        return(Counter((code, field) for _, field, code, _ in self.findings))
+
+    def render(self, level=logging.WARNING, max_per_field=MAX_PER_FIELD):
+        '''Logs findings in row order at or above level, at most
+        max_per_field of each field and code (0 for no limit)'''
+        self.findings.sort(key=lambda f: f[0])
+        shown = Counter()
+        for rownum, field, code, value in self.findings:
+            flevel, message = MESSAGES[code]
+            if flevel < level:
+                continue
+            shown[(code, field)] += 1
+            if max_per_field and shown[(code, field)] > max_per_field:
+                continue
+            logger.log(
+                flevel, message.format(value),
+                extra={'rownum': rownum, 'field': field})
+        for (code, field), count in shown.items():
+            if max_per_field and count > max_per_field:
+                d = {'rownum': '-', 'field': field}
+                logger.log(
+                    MESSAGES[code][0],
+                    '%s more %s findings not shown',
+                    count - max_per_field, code, extra=d)
+
+    def summary(self):
+        counts = self.counts()
+        if counts:
+            print('Findings in', self.source)
+            for (code, field), count in sorted(
+                    counts.items(), key=lambda x: (-x[1], x[0])):
+                level = logging.getLevelName(MESSAGES[code][0])
+                print(f'{count:>8}  {level:<8} {code:<27} {field}')
+
+    def records(self):
+        for rownum, field, code, value in self.findings:
+            yield {
+                'sheet': self.source, 'row': rownum, 'field': field,
+                'code': code, 'level': logging.getLevelName(
+                    MESSAGES[code][0]), 'value': value}
+
+
+def write_report(path, collectors):
+    '''Writes findings to a CSV file if path ends with .csv, otherwise to a
+    JSON Lines file'''
+    with open(path, 'w', encoding='utf-8', newline='') as f:
+        if path.lower().endswith('.csv'):
+            writer = csv.DictWriter(
+                f, ['sheet', 'row', 'field', 'code', 'level', 'value'])
+            writer.writeheader()
+            for c in collectors:
+                writer.writerows(c.records())
+        else:
+            for c in collectors:
+                for r in c.records():
+                    f.write(json.dumps(r) + '\n')
+
+
+_plan = None
+
+
+class plan(object):
+    '''Validation plan compiled once from the headings of a sheet. Maps
+    the fields the checks need to column indexes and groups the
+    MulMultiMediaRef_tab(n) columns, so rows can be validated as plain
+    lists of values. Rows must be padded with plan.pad, which adds a blank
+    column that headings missing from the sheet point at'''
+
+    def __init__(self, fieldnames, mandatory=True):
+        self.fieldnames = list(fieldnames)
+        self.mandatory = mandatory
+        self.blank = len(self.fieldnames)
+        self.index = {}
+        groups = {}
+        for column, field in enumerate(self.fieldnames):
+            self.index.setdefault(field, column)
+            m = REG_MUL.fullmatch(field)
+            if m is not None:
+                n = int(m[1]) if m[1] is not None else 1
+                prefix = field.split('.')[0]
+                group = groups.setdefault(n, (prefix, {}))
+                group[1].setdefault(m[2], column)
+        self.multimedia = [
+            (prefix, tuple(cols.values()), cols)
+            for _, (prefix, cols) in sorted(groups.items())]
+        self.record_cols = [self.column(f) for f in record_heads]
+        self.man_cols = [(f, self.column(f)) for f in man_heads]
+        self.holder_cols = [(f, self.column(f)) for f in holder_heads]
+
+    def column(self, field):
+        return(self.index.get(field, self.blank))
+
+    def pad(self, values):
+        '''Pads or truncates a row to the width of the plan'''
+        width = self.blank + 1
+        if len(values) < width:
+            values.extend([''] * (width - len(values)))
+        elif len(values) > width:
+            del values[width:]
+            values[self.blank] = ''
+        return(values)
+
+    def check_headings(self, sink):
+        for column, field in enumerate(self.fieldnames, 1):
+            if field.endswith(')'):
+                f = field.split('(')[0]
+            else:
+                f = field
+            if f == '':
+                sink.add(1, 'None', 'blank-heading', column)
+            elif f.startswith('MulMultiMediaRef_tab'):
+                m = REG_MUL.fullmatch(field)
+                if m is None or m[2] not in mult_heads:
+                    sink.add(1, f, 'invalid-multimedia-heading', f)
+            elif f not in all_heads:
+                sink.add(1, field, 'invalid-heading', f)
+        if self.mandatory:
+            for field in man_heads:
+                if field not in self.index:
+                    sink.add(1, field, 'missing-heading')
+        counts = Counter(self.fieldnames)
+        for field, count in counts.items():
+            if count > 1 and field != '':
+                sink.add(1, field, 'duplicate-heading')
+
+    def check_holder_headings(self, sink):
+        for field in self.fieldnames:
+            if field not in holder_heads:
+                sink.add(1, field, 'invalid-heading', field)
+
+
+class multimedia(object):
+    '''Validates one MulMultiMediaRef_tab(n) group of a row. Whether the
+    resource exists is left to the resources cache'''
+    __slots__ = ('rownum', 'pref', 'values', 'cols', 'resource')
+
+    def __init__(self, values, rownum, pref, cols, sink):
         self.rownum = rownum
-        self.pref = list(self.keys())[0].split('.')[0]
-        self.d = {'rownum': self.rownum}
+        self.pref = pref
+        self.values = values
+        self.cols = cols
         self.resource = self.get_value('Multimedia')
-        if not os.path.exists(self.resource):
-            self.d['field'] = self.field_name('Multimedia')
-            logger.error(
-                'Cannot find resource: %s',
-                self.resource, extra=self.d)
-        if self.get_value('AdmPublishWebNoPassword') not in ('yes', 'no'):
-            self.d['field'] = self.field_name('AdmPublishWebNoPassword')
-            logger.error(
-                'Invalid value: %s',
-                self.get_value('AdmPublishWebNoPassword'), extra=self.d)
-
+        publish = self.get_value('AdmPublishWebNoPassword')
+        if publish not in ('yes', 'no', ''):
+            sink.add(
+                rownum, self.field_name('AdmPublishWebNoPassword'),
+                'invalid-publish', publish)
+        # Only the group's own columns; a sheet without, say, a MulTitle
+        # column has already had that reported as a missing heading
         for field in mult_heads:
-            if self.get(field) == '':
-                self.d['field'] = field
-                logger.warning(
-                    'Missing mandatory value', extra=self.d)
+            if field in cols and values[cols[field]] == '':
+                sink.add(rownum, self.field_name(field), 'missing-value')
 
     def get_value(self, suffix):
-        field = [field for field in self.keys() if field.endswith(suffix)]
-        if field != []:
-            return(self.get(field[0]))
+        column = self.cols.get(suffix)
+        if column is not None:
+            return(self.values[column])
         else:
-            return None
+            return('')
 
     def field_name(self, suffix):
         return(self.pref+'.'+suffix)
 
 
-class holder(dict):
-    def __init__(self, row, rownum):
-        super(holder, self).__init__(row)
+class holder(object):
+    '''Validates a row of a holder upload sheet on initialisation'''
+    __slots__ = ('rownum', 'values', 'plan', 'sink', 'loc', 'name')
+
+    def __init__(self, values, rownum, plan, sink):
         self.rownum = rownum
-        self.d = {'rownum': self.rownum}
-        self.loc = self.get('LocHolderLocationRef.LocLocationCode')
-        self.name = self.get('LocHolderName')
+        self.values = values
+        self.plan = plan
+        self.sink = sink
+        self.loc = values[plan.column('LocHolderLocationRef.LocLocationCode')]
+        self.name = values[plan.column('LocHolderName')]
         self.loc_check()
         self.field_check()
 
     def loc_check(self):
-        if re.fullmatch(r'[A-Z]{1,2}\d{1,2}/\d{1,2}', self.loc) is None:
-            self.d['field'] = 'LocHolderLocationRef.LocLocationCode'
-            logger.warning(
-                'Invalid location attribute: %s',
-                self.loc, extra=self.d)
+        if REG_LOC.fullmatch(self.loc) is None:
+            self.sink.add(
+                self.rownum, 'LocHolderLocationRef.LocLocationCode',
+                'invalid-location', self.loc)
 
     def field_check(self):
-        for field in holder_heads:
-            if self.get(field) == '':
-                self.d['field'] = field
-                logger.warning(
-                    'Missing mandatory value', extra=self.d)
+        for field, column in self.plan.holder_cols:
+            if self.values[column] == '':
+                self.sink.add(self.rownum, field, 'missing-value')
 
 
-class record(dict):
-    '''subclass of dict that validates incoming data on initialisation
-    according to UMA standards and EMu upload requirements'''
+class record(object):
+    '''Validates a row of an upload sheet on initialisation according to UMA
+    standards and EMu upload requirements, adding findings to sink. values
+    is a row padded with plan.pad. media lists the (field, path) of each
+    multimedia resource for the resources cache to check'''
+    __slots__ = (
+        'rownum', 'values', 'plan', 'sink', 'ident', 'title', 'date',
+        'edate', 'ldate', 'parent', 'location', 'level', 'media')
 
-    def __init__(self, row, rownum, mandatory=True):
-        super(record, self).__init__(row)
+    def __init__(self, values, rownum, plan, sink):
         self.rownum = rownum
-        self.date = self.get_value('EADUnitDate')
-        self.edate = self.get_value('EADUnitDateEarliest')
-        self.ldate = self.get_value('EADUnitDateLatest')
-        self.parent = self.get_value('AssParentObjectRef.EADUnitID')
-        self.ident = self.get_value('EADUnitID')
-        self.location = self.get_value('LocCurrentLocationRef.LocHolderName')
-        self.level = self.get_value('EADLevelAttribute')
-        self.reg_id = re.compile(r'\d{4}\.\d{4}\.\d{5}')
-        self.reg_pid = re.compile(r'\d{4}\.\d{4}(\.\d{5})?')
-        self.d = {'rownum': self.rownum}
+        self.values = values
+        self.plan = plan
+        self.sink = sink
+        (
+            self.ident, self.title, self.date, self.edate, self.ldate,
+            self.parent, self.location, self.level) = [
+                values[column] for column in plan.record_cols]
+        self.media = []
         self.check_multimedia()
-        if list(row.values()) == ['' for x in range(len(row.values()))]:
-            self.d['field'] = 'ALL'
-            logger.error(
-                'Blank row', extra=self.d)
-            raise Exception()
+        if not any(values):
+            sink.add(rownum, 'ALL', 'blank-row')
+            raise BlankRow('Blank row')
         self.date_check()
-        if mandatory:
+        if plan.mandatory:
             self.man_check()
 
-        if self.level not in ('Item', 'Sub-item', 'Unit') and self.level != '':
-            self.d['field'] = 'EADLevelAttribute'
-            logger.warning(
-                'Invalid level attribute: %s',
-                self.level, extra=self.d)
-
-        if self.reg_id.fullmatch(self.ident) is None:
-            self.d['field'] = 'EADUnitID'
-            logger.warning(
-                'Invalid identifier: %s',
-                self.ident, extra=self.d)
-        if self.reg_pid.fullmatch(self.parent) is None and self.parent != '':
-            self.d['field'] = 'AssParentObjectRef.EADUnitID'
-            logger.warning(
-                'Invalid parent identifier: %s',
-                self.parent, extra=self.d)
+        if self.level not in LEVELS and self.level != '':
+            sink.add(rownum, 'EADLevelAttribute', 'invalid-level', self.level)
+
+        if REG_ID.fullmatch(self.ident) is None:
+            sink.add(rownum, 'EADUnitID', 'invalid-id', self.ident)
+        if REG_PID.fullmatch(self.parent) is None and self.parent != '':
+            sink.add(
+                rownum, 'AssParentObjectRef.EADUnitID', 'invalid-parent-id',
+                self.parent)
 
         if self.parent not in self.location:
-            self.d['field'] = 'LocCurrentLocationRef.LocHolderName'
-            logger.info(
-                'Holder name does not match '
-                'AssParentObjectRef.EADUnitID: %s, %s',
-                self.location, self.parent, extra=self.d)
+            sink.add(
+                rownum, 'LocCurrentLocationRef.LocHolderName',
+                'holder-parent-mismatch',
+                f'{self.location}, {self.parent}')
         if self.parent not in self.ident and self.level == 'Item':
-            self.d['field'] = 'EADUnitID'
-            logger.warning(
-                'EADUnitID does not match '
-                'AssParentObjectRef.EADUnitID: %s, %s',
-                self.ident, self.parent, extra=self.d)
+            sink.add(
+                rownum, 'EADUnitID', 'id-parent-mismatch',
+                f'{self.ident}, {self.parent}')
 
     def check_multimedia(self):
-        for m in self.get_multimedia().values():
-            multi = multimedia(m, rownum)
-            if multi.get_value('MulTitle') is not None:
-                if multi.get_value('MulTitle') not in self.get('EADUnitTitle'):
-                    self.d['field'] = multi.field_name('MulTitle')
-                    logger.warning(
-                        'MulTitle does not match EadUnitTitle: %s, %s',
-                        multi.field_name('MulTitle'), self.get('EADUnitTitle'),
-                        extra=self.d)
-
-    def get_value(self, field):
-        if self.get(field) is not None:
-            return(self.get(field))
-        else:
-            return('')
+        values = self.values
+        for pref, columns, cols in self.plan.multimedia:
+            if any(values[column] for column in columns):
+                multi = multimedia(values, self.rownum, pref, cols, self.sink)
+                if multi.resource != '':
+                    self.media.append(
+                        (multi.field_name('Multimedia'), multi.resource))
+                title = multi.get_value('MulTitle')
+                if title != '' and title not in self.title:
+                    self.sink.add(
+                        self.rownum, multi.field_name('MulTitle'),
+                        'title-mismatch', f'{title}, {self.title}')
 
     def date_check(self):
-        self.d = {'rownum': self.rownum}
-        if self.date.isnumeric() and self.date != self.edate:
-            date = int(self.date)
-            self.d['field'] = 'EADUnitDate'
-            logger.warning(
-                'Excel mangled date: %s, should be %s',
-                self.date, from_excel_ordinal(date),
-                extra=self.d)
+        if self.date.isdecimal() and self.date != self.edate:
+            excel = from_excel_ordinal(int(self.date))
+            if excel is None:
+                self.sink.add(
+                    self.rownum, 'EADUnitDate', 'invalid-date', self.date)
+            else:
+                self.sink.add(
+                    self.rownum, 'EADUnitDate', 'excel-date',
+                    f'{self.date}, should be {excel}')
         elif '/' in self.date or 'circa' in self.date.lower():
-            self.d['field'] = 'EADUnitDate'
-            logger.warning(
-                'Invalid date format: %s', self.date, extra=self.d)
+            self.sink.add(
+                self.rownum, 'EADUnitDate', 'invalid-date', self.date)
         else:
-            months = re.findall('[a-z,A-Z]+', self.date)
-            excepts = ['c', 'Undated']+list(calendar.month_name)
-            for month in months:
-                if month not in excepts:
-                    self.d['field'] = 'EADUnitDate'
-                    logger.warning(
-                        'Invalid date format: %s', self.date, extra=self.d)
+            for month in REG_WORD.findall(self.date):
+                if month not in DATE_WORDS:
+                    self.sink.add(
+                        self.rownum, 'EADUnitDate', 'invalid-date', self.date)
         try:
             if int(self.edate) > int(self.ldate):
-                self.d['field'] = 'EADUnitDateEarliest'
-                logger.warning(
-                    'Earliest date later than latest: %s, %s',
-                    self.edate, self.ldate, extra=self.d)
-        except (ValueError, TypeError):
+                self.sink.add(
+                    self.rownum, 'EADUnitDateEarliest', 'date-order',
+                    f'{self.edate}, {self.ldate}')
+        except ValueError:
             pass
 
     def man_check(self):
-        self.d = {'rownum': self.rownum}
-        for field in man_heads:
-            if self.get_value(field) == '':
+        values = self.values
+        for field, column in self.plan.man_cols:
+            if values[column] == '':
                 if field in ('EADUnitDateEarliest', 'EADUnitDateLatest') and self.date == 'Undated':
                     pass
                 else:
-                    self.d['field'] = field
-                    logger.error(
-                        'Missing mandatory value', extra=self.d)
-
-    def get_multimedia(self):
-        multi = {}
-        for k, v in self.items():
-            if k.startswith('MulMultiMediaRef_tab') and v != '':
-                ind = re.findall(r'\((\d+)\)', k)
-                if ind != []:
-                    ind = int(ind[0])
-                else:
-                    ind = 1
-                if multi.get(ind) is None:
-                    multi.update({ind: {k: v}})
-                else:
-                    multi[ind].update({k: v})
-        return(multi)
+                    self.sink.add(self.rownum, field, 'missing-mandatory')
+
+
+class sheet_reader(object):
+    '''Iterates over the rows of a delimited upload sheet one at a time as
+    lists of values. The dialect is sniffed from a bounded sample at the
+    start of the file, so memory use stays flat however large the sheet
+    is'''
+
+    def __init__(self, path, sample_size=delimited.SNIFF_SAMPLE):
+        self.path = path
+        self.f = open(path, encoding='utf-8-sig', newline='')
+        try:
+            self.dialect = delimited.sniff(self.f, sample_size)
+            self.reader = csv.reader(self.f, dialect=self.dialect)
+            self.fieldnames = next(self.reader, [])
+        except Exception:
+            self.f.close()
+            raise
+
+    def __iter__(self):
+        for values in self.reader:
+            for i, v in enumerate(values):
+                if '\r\n' in v:
+                    values[i] = v.replace('\r\n', '|')
+            yield values
+
+    def close(self):
+        self.f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def cell_text(value):
+    '''Renders a typed worksheet cell the way it would appear in a
+    delimited export, except that dates are written in UMA form'''
+    if value is None:
+        return('')
+    elif isinstance(value, str):
+        return(value.replace('\r\n', '|'))
+    elif isinstance(value, (datetime, date)):
+        return(value.strftime('%d %B %Y').lstrip('0'))
+    elif isinstance(value, bool):
+        return(str(value).upper())
+    elif isinstance(value, float) and value.is_integer():
+        return(str(int(value)))
+    else:
+        return(str(value))
+
+
+class workbook_reader(object):
+    '''Iterates over the rows of the first worksheet of an .xlsx upload
+    sheet as lists of values, using a read-only workbook so rows are
+    streamed from the file. Runs of blank rows are only passed on if a row
+    with values follows them'''
+
+    def __init__(self, path):
+        try:
+            import openpyxl
+        except ImportError:
+            print(
+                "You don't have openpyxl installed. "
+                "Try 'pip install openpyxl'")
+            exit()
+        self.path = path
+        self.wb = openpyxl.load_workbook(path, read_only=True, data_only=True)
+        self.rows = self.wb.worksheets[0].iter_rows(values_only=True)
+        header = [cell_text(v) for v in next(self.rows, ())]
+        while header and header[-1] == '':
+            header.pop()
+        self.fieldnames = header
+
+    def __iter__(self):
+        blanks = 0
+        for row in self.rows:
+            values = [cell_text(v) for v in row]
+            if not any(values):
+                blanks += 1
+                continue
+            for _ in range(blanks):
+                yield [''] * len(self.fieldnames)
+            blanks = 0
+            yield values
+
+    def close(self):
+        self.wb.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def is_workbook(path):
+    return(path.lower().endswith(('.xlsx', '.xlsm')))
 
 
 def get_reader(path):
-    with open(path, encoding='utf-8') as f:
-        text = f.read()
-        text = text.replace('\r\n', '|').lstrip('\ufeff')
-    dialect = csv.Sniffer().sniff(text)
-    reader = csv.DictReader(StringIO(text), dialect=dialect)
-    return(reader)
-
-
-def check_fields(fields, mandatory=True):
-    d = {'rownum': 1}
-    for column, field in enumerate(fields, 1):
-        if field.endswith(')'):
-            f = field.split('(')[0]
+    if is_workbook(path):
+        return(workbook_reader(path))
+    return(sheet_reader(path))
+
+
+def list_dir(path):
+    try:
+        return(frozenset(os.path.normcase(n) for n in os.listdir(path)))
+    except OSError:
+        return(frozenset())
+
+
+class resources(object):
+    '''Checks that multimedia resources exist by listing each parent
+    directory once rather than statting every file. A listing is started
+    in a bounded thread pool as soon as a new directory is seen, so the
+    round trips to a network share overlap with validating the sheet'''
+
+    def __init__(self, threads=RESOURCE_THREADS):
+        self.ex = ThreadPoolExecutor(threads)
+        self.dirs = {}
+        self.normal = {}
+        self.pending = []
+
+    def split(self, path):
+        directory, name = os.path.split(path)
+        if name in ('', '.', '..'):
+            return(os.path.split(os.path.normcase(os.path.abspath(path))))
+        normal = self.normal.get(directory)
+        if normal is None:
+            normal = os.path.normcase(os.path.abspath(directory))
+            self.normal[directory] = normal
+        return(normal, os.path.normcase(name))
+
+    def listing(self, directory):
+        if directory not in self.dirs:
+            self.dirs[directory] = self.ex.submit(list_dir, directory)
+        return(self.dirs[directory])
+
+    def add(self, rownum, field, path):
+        directory, name = self.split(path)
+        self.listing(directory)
+        self.pending.append((rownum, field, path, directory, name))
+
+    def check(self, sink):
+        listings = {}
+        for rownum, field, path, directory, name in self.pending:
+            names = listings.get(directory)
+            if names is None:
+                names = listings[directory] = self.dirs[directory].result()
+            if name not in names:
+                sink.add(rownum, field, 'missing-resource', path)
+        self.pending = []
+
+    def close(self):
+        self.ex.shutdown()
+
+
+class integrity(object):
+    '''Cross-row and cross-sheet checks for an upload sheet. Identifiers,
+    holders and parent references are kept in sets and dicts, so each
+    check costs a constant-time lookup per row'''
+
+    def __init__(self, sink, holders=None, existing=None, resolver=None):
+        self.sink = sink
+        self.holders = holders
+        self.existing = existing if existing is not None else set()
+        self.resolver = resolver if resolver is not None else resources()
+        self.ids = {}
+        self.parents = {}
+
+    def add(self, rownum, ident, location, parent, media=()):
+        for field, path in media:
+            self.resolver.add(rownum, field, path)
+        if ident != '':
+            first = self.ids.setdefault(ident, rownum)
+            if first != rownum:
+                self.sink.add(
+                    rownum, 'EADUnitID', 'duplicate-id',
+                    f'{ident}, first used in row {first}')
+        if self.holders is not None and location not in self.holders:
+            self.sink.add(
+                rownum, 'LocCurrentLocationRef.LocHolderName',
+                'missing-holder', location)
+        if parent != '':
+            if parent in self.parents:
+                self.parents[parent][1] += 1
+            else:
+                self.parents[parent] = [rownum, 1]
+
+    def check(self):
+        '''Report missing resources and each parent reference that is
+        neither a row in the sheet nor an existing identifier. Run once all
+        rows have been added'''
+        self.resolver.check(self.sink)
+        if self.existing:
+            code = 'missing-parent'
         else:
-            f = field
-        if f not in all_heads and f != '' and not f.startswith('MulMultiMediaRef_tab'):
-            d['field'] = field
-            logger.error(
-                'Invalid column heading: %s', f, extra=d)
-        elif f == '':
-            d['field'] = 'None'
-            logger.error(
-                'blank column heading: column {}'.format(column),
-                extra=d)
-        elif f.startswith('MulMultiMediaRef_tab'):
-            ff = f.split('.')[1]
-            if ff not in mult_heads:
-                d['field'] = f
-                logger.error(
-                    'Invalid multimedia column heading: %s', f,
-                    extra=d)
-    if mandatory:
-        for field in man_heads:
-            if field not in reader.fieldnames:
-                d['field'] = field
-                logger.error('Missing mandatory column heading', extra=d)
-    counts = Counter(reader.fieldnames)
-    for field, count in counts.items():
-        if count > 1 and field != '':
-            d['field'] = field
-            logger.error('Duplicate column heading', extra=d)
+            code = 'parent-not-in-sheet'
+        for parent, (rownum, count) in self.parents.items():
+            if parent not in self.ids and parent not in self.existing:
+                self.sink.add(
+                    rownum, 'AssParentObjectRef.EADUnitID', code,
+                    f'{parent} ({count} rows)')
+
+
+def load_ids(path):
+    '''Reads a snapshot of existing EADUnitIDs, either one per line or a
+    delimited export or workbook with an EADUnitID column'''
+    if is_workbook(path):
+        header = 'EADUnitID,'
+    else:
+        with open(path, encoding='utf-8-sig') as f:
+            header = f.readline()
+    # A lone EADUnitID column has no delimiter for the sniffer to find, and
+    # the header may only name a column such as AssParentObjectRef.EADUnitID,
+    # so both are read as one ID per line like a plain list
+    if 'EADUnitID' in header and header.strip() != 'EADUnitID':
+        try:
+            with get_reader(path) as reader:
+                if 'EADUnitID' in reader.fieldnames:
+                    column = reader.fieldnames.index('EADUnitID')
+                    return({
+                        values[column] for values in reader
+                        if len(values) > column and values[column] != ''})
+        except csv.Error:
+            pass
+    with open(path, encoding='utf-8-sig') as f:
+        ids = {line.strip() for line in f if line.strip() != ''}
+    if 'EADUnitID' in header:
+        ids.discard(header.strip())
+    return(ids)
+
+
+class row_cache(object):
+    '''Findings from earlier runs over a sheet, keyed by a hash of each
+    row's values. Rows that have not changed since the last run reuse their
+    findings; the cache is thrown away if the headings or the mandatory
+    setting change. Only rows seen in this run are saved'''
+    version = 1
+
+    def __init__(self, path, p, cache_dir=CACHE_DIR):
+        name = hashlib.sha1(os.path.abspath(path).encode('utf-8')).hexdigest()
+        self.path = os.path.join(cache_dir, name + '.pickle')
+        self.signature = (self.version, tuple(p.fieldnames), p.mandatory)
+        self.old = {}
+        self.new = {}
+        self.hits = 0
+        self.misses = 0
+        try:
+            with open(self.path, 'rb') as f:
+                signature, rows = pickle.load(f)
+            if signature == self.signature:
+                self.old = rows
+        except (OSError, EOFError, ValueError, pickle.UnpicklingError):
+            pass
+
+    def key(self, values):
+        return(hashlib.blake2b(
+            '\x1f'.join(values).encode('utf-8', 'surrogatepass'),
+            digest_size=16).digest())
+
+    def get(self, key, rownum):
+        entry = self.old.get(key)
+        if entry is None:
+            self.misses += 1
+            return(None)
+        self.hits += 1
+        self.new[key] = entry
+        keys, findings = entry
+        return(keys, [(rownum, f, c, v) for f, c, v in findings])
+
+    def put(self, key, keys, findings):
+        self.new[key] = (keys, [(f, c, v) for _, f, c, v in findings])
+
+    def save(self):
+        if self.misses == 0 and len(self.new) == len(self.old):
+            return
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp = self.path + '.tmp'
+        with open(tmp, 'wb') as f:
+            pickle.dump(
+                (self.signature, self.new), f, pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, self.path)
+
+
+def validate_row(values, rownum, p):
+    '''Validates a single row. Returns the values the integrity checks
+    need, which are None for blank rows and rows that could not be
+    checked, and the row's findings'''
+    sink = diagnostics()
+    try:
+        r = record(p.pad(values), rownum, p, sink)
+        keys = (r.ident, r.location, r.parent, r.media)
+    except BlankRow:
+        keys = None
+    except Exception as e:
+        # A bug in one check shouldn't stop the rest of the sheet
+        sink.add(rownum, 'ALL', 'row-error', f'{type(e).__name__}: {e}')
+        keys = None
+    return(keys, sink.findings)
+
+
+def merge(checks, rownum, keys, findings):
+    checks.sink.extend(findings)
+    if keys is not None:
+        checks.add(rownum, *keys)
+
+
+def lookup(cache, values, rownum):
+    if cache is None:
+        return(None, None)
+    key = cache.key(values)
+    return(key, cache.get(key, rownum))
+
+
+def validate(reader, p, checks, cache=None):
+    for rownum, values in enumerate(reader, 2):
+        key, result = lookup(cache, values, rownum)
+        if result is None:
+            result = validate_row(values, rownum, p)
+            if cache is not None:
+                cache.put(key, *result)
+        merge(checks, rownum, *result)
+
+
+def _init_worker(fieldnames, mandatory):
+    global _plan
+    _plan = plan(fieldnames, mandatory=mandatory)
+
+
+def validate_chunk(chunk):
+    '''Validates a chunk of (rownum, values) rows in a worker process and
+    returns (rownum, keys, findings) for each'''
+    return([
+        (rownum,) + validate_row(values, rownum, _plan)
+        for rownum, values in chunk])
+
+
+def chunked(reader, size=CHUNK_SIZE):
+    chunk = []
+    for rownum, values in enumerate(reader, 2):
+        chunk.append((rownum, values))
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def validate_parallel(
+        reader, p, checks, jobs, chunk_size=CHUNK_SIZE, cache=None):
+    '''Validates chunks of rows in a pool of jobs processes. Rows found in
+    the cache are not sent to the pool. Findings are collected in row order
+    and the integrity checks run here as each chunk comes back. At most two
+    chunks per process are held in memory'''
+    def merge_batch(batch, future):
+        results = {}
+        if future is not None:
+            results = {r[0]: r[1:] for r in future.result()}
+        for rownum, key, result in batch:
+            if result is None:
+                result = results[rownum]
+                if cache is not None:
+                    cache.put(key, *result)
+            merge(checks, rownum, *result)
+
+    with ProcessPoolExecutor(
+            jobs, initializer=_init_worker,
+            initargs=(p.fieldnames, p.mandatory)) as ex:
+        pending = deque()
+        for chunk in chunked(reader, chunk_size):
+            batch = []
+            misses = []
+            for rownum, values in chunk:
+                key, result = lookup(cache, values, rownum)
+                if result is None:
+                    misses.append((rownum, values))
+                batch.append((rownum, key, result))
+            future = None
+            if misses:
+                future = ex.submit(validate_chunk, misses)
+            pending.append((batch, future))
+            if len(pending) >= jobs * 2:
+                merge_batch(*pending.popleft())
+        while pending:
+            merge_batch(*pending.popleft())
 
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(
-        description='Check an EMu upload delimited file for possible errors '
+        description='Check an EMu upload sheet for possible errors '
         'and data quality issues')
     parser.add_argument(
-        'file', metavar='i', type=str, help='delimited upload file')
+        'file', metavar='i', type=str,
+        help='delimited or .xlsx upload file')
     parser.add_argument(
         '--holders', type=str,
-        help='optional holder upload file')
+        help='optional delimited or .xlsx holder upload file')
     parser.add_argument(
         '--mandatory', '-m', action='store_false',
         help="don't check for mandatory headings or values")
+    parser.add_argument(
+        '--existing', type=str,
+        help='optional file of EADUnitIDs already in EMu, one per line or '
+        'an export with an EADUnitID column')
+    parser.add_argument(
+        '--jobs', '-j', type=int, default=1,
+        help='number of processes to validate rows with (default is 1)')
+    parser.add_argument(
+        '--resource-threads', type=int, default=RESOURCE_THREADS,
+        help='number of directories to list at once when checking that '
+        'multimedia resources exist (default is {})'.format(
+            RESOURCE_THREADS))
+    parser.add_argument(
+        '--report', type=str,
+        help='write all findings to a .csv file or, for any other '
+        'extension, a JSON Lines file')
+    parser.add_argument(
+        '--max-per-field', type=int, default=MAX_PER_FIELD,
+        help='most messages to show for each field and problem, 0 for no '
+        'limit (default is {})'.format(MAX_PER_FIELD))
+    parser.add_argument(
+        '--cache', action='store_true',
+        help='reuse the findings for rows that have not changed since the '
+        'last run over this sheet')
+    parser.add_argument(
+        '--cache-dir', default=CACHE_DIR,
+        help='where to keep the row cache (default is {})'.format(CACHE_DIR))
+    verbosity = parser.add_mutually_exclusive_group()
+    verbosity.add_argument(
+        '--verbose', '-v', dest='level', action='store_const',
+        const=logging.INFO, default=logging.WARNING,
+        help='also show informational messages')
+    verbosity.add_argument(
+        '--quiet', '-q', dest='level', action='store_const',
+        const=logging.ERROR, help='only show errors')
     args = parser.parse_args()
+    logger.setLevel(args.level)
 
-    ids = []
+    collectors = []
+    holders = None
     if args.holders is not None:
         print('Parsing ', args.holders)
-        h_reader = get_reader(args.holders)
-        holders = []
-        for rownum, row in enumerate(h_reader, 2):
-            h = holder(row, rownum)
-            holders.append(h.name)
-        for field in h_reader.fieldnames:
-            if field not in holder_heads:
-                d = {'rownum': 1, 'field': field}
-                logger.error(
-                    'Invalid column heading: %s', field, extra=d)
+        holders = set()
+        h_sink = diagnostics(args.holders)
+        with get_reader(args.holders) as h_reader:
+            h_plan = plan(h_reader.fieldnames)
+            for rownum, values in enumerate(h_reader, 2):
+                h = holder(h_plan.pad(values), rownum, h_plan, h_sink)
+                holders.add(h.name)
+            h_plan.check_holder_headings(h_sink)
+        h_sink.render(args.level, args.max_per_field)
+        collectors.append(h_sink)
         print('\n')
+    existing = None
+    if args.existing is not None:
+        existing = load_ids(args.existing)
+    resolver = resources(threads=args.resource_threads)
+    sink = diagnostics(args.file)
+    checks = integrity(
+        sink, holders=holders, existing=existing, resolver=resolver)
     print('Parsing', args.file)
-    reader = get_reader(args.file)
-    check_fields(reader.fieldnames, mandatory=args.mandatory)
-    for rownum, row in enumerate(reader, 2):
+    with get_reader(args.file) as reader:
+        p = plan(reader.fieldnames, mandatory=args.mandatory)
+        p.check_headings(sink)
+        cache = None
+        if args.cache:
+            cache = row_cache(args.file, p, cache_dir=args.cache_dir)
+        if args.jobs > 1:
+            validate_parallel(reader, p, checks, args.jobs, cache=cache)
+        else:
+            validate(reader, p, checks, cache=cache)
+    if cache is not None:
+        print(
+            'Reused findings for {} of {} rows from the cache'.format(
+                cache.hits, cache.hits + cache.misses))
+    checks.check()
+    resolver.close()
+    sink.render(args.level, args.max_per_field)
+    collectors.append(sink)
+    if cache is not None:
         try:
-            r = record(row, rownum, mandatory=args.mandatory)
-            if r.ident in ids:
-                d = {'rownum': r.rownum, 'field': 'EADUnitID'}
-                logger.error(
-                    'Duplicate EADUnitID: %s', r.ident, extra=d)
-            if args.holders is not None:
-                if r.location not in holders:
-                    d = {
-                        'rownum': r.rownum, 'field':
-                        'LocCurrentLocationRef.LocHolderName'}
-                    logger.error(
-                        'Holder not in holder spreadsheet: %s',
-                        r.location, extra=d)
-            ids.append(r.ident)
-        except Exception:
-            pass
+            cache.save()
+        except OSError as e:
+            print('Could not save the row cache:', e)
+    print('\n')
+    for c in collectors:
+        c.summary()
+    if args.report is not None:
+        write_report(args.report, collectors)
@@ -0,0 +1,101 @@
+'''Concurrent directory traversal shared by digi_walk and bulk_mover.
+
+On a high-latency share nearly all of a walk is spent waiting for directory
+listings, so walk lists directories ahead of time on a bounded pool of
+threads while still yielding files in the same top-down order as os.walk.
+traverse does the same for any per-directory work, such as digi_walk's
+index refresh.
+'''
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+THREADS = 16
+# Listings kept running ahead of the caller, as a multiple of threads
+AHEAD = 4
+
+
+def list_dir(path):
+    '''Returns lists of the file and subdirectory DirEntry objects in path,
+    in listing order. Symlinks to directories are in neither list, so they
+    are not followed, and unreadable directories are treated as empty'''
+    files = []
+    subdirs = []
+    try:
+        with os.scandir(path) as it:
+            for entry in it:
+                try:
+                    is_dir = entry.is_dir()
+                except OSError:
+                    is_dir = False
+                if is_dir and not entry.is_symlink():
+                    subdirs.append(entry)
+                elif not is_dir:
+                    files.append(entry)
+    except OSError:
+        pass
+    return(files, subdirs)
+
+
+def traverse(roots, visit, expand, threads=THREADS):
+    '''Runs visit(item) on a pool of threads for each of roots and every item
+    expand(item, result) returns for them, depth first, and yields each item
+    with its result in that order. expand runs on the calling thread. Visits
+    only run up to AHEAD times threads items ahead of the caller, so a slow
+    caller doesn't get the whole tree held in memory'''
+    limit = threads * AHEAD
+    pool = ThreadPoolExecutor(max_workers=threads)
+    # Each pending item is [item, future], with no future until submitted
+    stack = [[item, None] for item in reversed(roots)]
+    running = 0
+
+    def submit_ahead():
+        # The top of the stack is needed soonest
+        nonlocal running
+        for pending in reversed(stack):
+            if running >= limit:
+                break
+            if pending[1] is None:
+                pending[1] = pool.submit(visit, pending[0])
+                running += 1
+
+    try:
+        submit_ahead()
+        while stack:
+            item, future = stack.pop()
+            running -= 1
+            result = future.result()
+            stack.extend(
+                [child, None] for child in reversed(expand(item, result)))
+            # Queue the visits below this item before handing it out, so they
+            # are done while the caller works
+            submit_ahead()
+            yield item, result
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+def walk(roots, exts=None, ignore_case=False, threads=THREADS, sort=False):
+    '''Yields a DirEntry for each file under roots with an extension in exts
+    (or every file if exts is None). Entries keep the stat data scandir
+    gathered. With sort, files and subdirectories are taken in name order
+    rather than listing order, so the output doesn't depend on the server'''
+    if isinstance(roots, (str, os.PathLike)):
+        roots = [roots]
+    if exts is not None:
+        exts = {e.lower() for e in exts} if ignore_case else set(exts)
+
+    def expand(path, listing):
+        files, subdirs = listing
+        if sort:
+            files.sort(key=lambda e: e.name)
+            subdirs.sort(key=lambda e: e.name)
+        return([d.path for d in subdirs])
+
+    for path, (files, subdirs) in traverse(
+            [os.fspath(r) for r in roots], list_dir, expand, threads=threads):
+        for entry in files:
+            if exts is not None:
+                ext = os.path.splitext(entry.name)[1]
+                if (ext.lower() if ignore_case else ext) not in exts:
+                    continue
+            yield entry